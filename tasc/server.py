@@ -1,22 +1,62 @@
 import math
 import json
 import asyncio
+import logging
 import time
 import os
+import gzip
+import hashlib
 
-from dataclasses import dataclass
+from array import array
+from dataclasses import dataclass, field
 from collections import deque
-from typing import Optional, List, Tuple
+from functools import lru_cache
+from typing import Literal, Optional, List, Tuple
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
 from fastapi.responses import HTMLResponse
-from fastapi.responses import FileResponse
+from fastapi.responses import Response
 from fastapi.staticfiles import StaticFiles
+from fastapi.middleware.gzip import GZipMiddleware
+
+try:
+    import orjson
+except ImportError:  # orjson은 선택 의존성: 없으면 표준 json으로 직렬화
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # msgspec은 선택 의존성: 없으면 orjson/표준 json 경로 사용
+    msgspec = None
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:  # numba는 선택 의존성: 없으면 같은 함수를 순수 파이썬으로 실행
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
+try:
+    import uvloop
+except ImportError:  # uvloop은 선택 의존성: 없으면 asyncio 기본 이벤트 루프 사용
+    uvloop = None
 
 # ------------------------------------------------------------
 # Config
 # ------------------------------------------------------------
 DEBUG = False  # 디버그 로그를 보고 싶으면 True
+
+# 디버그 출력은 logger.debug + %-포맷: 레벨이 꺼져 있으면 문자열을 만들지 않는다
+logger = logging.getLogger("tasc")
+logger.setLevel(logging.DEBUG if DEBUG else logging.INFO)
+if DEBUG and not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_log_handler)
 # I realized that the soft stop logic does not make sense and makes the simulation less realistic 
 # soft_stop_di = 10.0 
 # soft_stop_const = -0.18
@@ -119,10 +159,9 @@ class Vehicle:
             self.C2 = 6.6096
             return
 
-        if DEBUG:
-            print(f"[Davis Recompute] Type={self.type}, Mass={m/1000:.1f}t")
-            print(f"   -> Result: A0={self.A0:.1f}, B1={self.B1:.2f}, C2={self.C2:.2f}")
-            print(f"   -> Params: Cd={self.Cd}, A={self.A}, TechFactor={tech_efficiency}")
+        logger.debug("[Davis Recompute] Type=%s, Mass=%.1ft", self.type, m/1000)
+        logger.debug("   -> Result: A0=%.1f, B1=%.2f, C2=%.2f", self.A0, self.B1, self.C2)
+        logger.debug("   -> Params: Cd=%s, A=%s, TechFactor=%s", self.Cd, self.A, tech_efficiency)
 
     def update_mass(self, length: int):
         """편성 량 수에 맞춰 총 질량(kg)을 업데이트"""
@@ -132,22 +171,21 @@ class Vehicle:
 
     @classmethod
     def from_json(cls, filepath):
-        with open(filepath, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = load_json(filepath)
         mass_t = data.get("mass_t", 200.0)
         obj = cls(
             name=data.get("name", "EMU-233-JR-East"),
             a_max=data.get("a_max", 1.0),
             j_max=data.get("j_max", 0.8),
             notches=data.get("notches", 8),
-            notch_accels=data.get(
+            notch_accels=list(data.get(
                 "notch_accels",
                 [-1.5, -1.10, -0.95, -0.80, -0.65, -0.50, -0.35, -0.20, 0.0],
-            ),
+            )),
             maxSpeed_kmh=data.get("maxSpeed_kmh", 140.0),
             stop_accuracy_m=data.get("stop_accuracy_m", 1.0),
             forward_notches=data.get("forward_notches", 5),
-            forward_notch_accels=data.get("forward_notch_accels", [ 0.250, 0.287, 0.378, 0.515, 0.694 ]),
+            forward_notch_accels=list(data.get("forward_notch_accels", [ 0.250, 0.287, 0.378, 0.515, 0.694 ])),
             tau_cmd=data.get("tau_cmd_ms", 150) / 1000.0,
             tau_brk=data.get("tau_brk_ms", 250) / 1000.0,
             mass_t=mass_t,
@@ -188,8 +226,7 @@ class Scenario:
 
     @classmethod
     def from_json(cls, filepath):
-        with open(filepath, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = load_json(filepath)
         v0_kmph = data.get("v0", 25.0)
         v0_ms = v0_kmph / 3.6
         return cls(
@@ -201,7 +238,7 @@ class Scenario:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class State:
     t: float = 0.0
     s: float = 0.0
@@ -228,22 +265,523 @@ class State:
     time_overrun_int: int = 0             # 초과 시간 정수 표시
     time_overrun_started: bool = False    # 오버런 진입 여부
 
+    issues: dict = field(default_factory=dict)  # 채점/타임아웃 이슈 플래그
+
+
+@dataclass(slots=True)
+class TascPredCache:
+    """TASC 정지거리 예측 캐시 (매 step 조회되므로 slots 고정 필드)"""
+    valid_until: float = -1.0    # 이 시각 전까지 캐시 유효
+    v: float = -1.0
+    notch: int = -1
+    has_cur: bool = False        # s_cur까지 계산된 항목인지 (relax 단계에서는 생략)
+    s_cur: float = float('inf')
+    s_dn: float = float('inf')
+
 
 # ------------------------------------------------------------
 # Helpers
 # ------------------------------------------------------------
 
+@lru_cache(maxsize=64)
 def build_vref(L: float, a_ref: float):
+    # 순수 함수라 (L, a_ref)별로 접속 간 공유 가능 (advanceStation/차량 교체 시 같은 쌍이 반복됨)
+    two_aref = max(0.0, 2.0 * a_ref)  # 생성 시 한 번만 계산
+    sqrt = math.sqrt
+
     def vref(s: float):
-        rem = max(0.0, L - s)
-        return math.sqrt(max(0.0, 2.0 * a_ref * rem))
+        rem = L - s
+        return sqrt(two_aref * rem) if rem > 0.0 else 0.0
     return vref
 
 
+def _encode_json_std(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# 전송용 JSON 직렬화 (UTF-8 bytes). msgspec > orjson > 표준 json 순으로 C 구현을 직접 바인딩 (프레임마다 분기/호출 한 겹 절약)
+if msgspec is not None:
+    encode_json = msgspec.json.Encoder().encode
+elif orjson is not None:
+    encode_json = orjson.dumps
+else:
+    encode_json = _encode_json_std
+
+
+@lru_cache(maxsize=32)
+def _load_json_cached(path: str, mtime: float) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_json(path: str) -> dict:
+    """설정 JSON 로드 (경로+수정시각 기준 캐시; 파일이 바뀌면 다시 읽음).
+    반환 dict는 호출 간 공유되므로 수정하지 말 것"""
+    return _load_json_cached(path, os.path.getmtime(path))
+
+
+# ------------------------------------------------------------
+# Physics kernels (스칼라 float 입출력, numba 있으면 네이티브 컴파일)
+# ------------------------------------------------------------
+# 커널은 전역 상수와 스칼라 인자만 사용 (객체/문자열 없음) → numba nopython 및
+# Cython 등 다른 컴파일 백엔드로 그대로 옮길 수 있는 형태를 유지한다.
+
+logger.debug("[PHYSICS] kernel backend: %s", 'numba' if HAVE_NUMBA else 'pure python')
+
+_V_KMH_3 = 3.0 / 3.6    # 3 km/h [m/s]
+_V_KMH_5 = 5.0 / 3.6    # 5 km/h
+_V_KMH_8 = 8.0 / 3.6    # 8 km/h
+_V_KMH_10 = 10.0 / 3.6  # 10 km/h
+_V_KMH_15 = 15.0 / 3.6  # 15 km/h
+_V_KMH_20 = 20.0 / 3.6  # 20 km/h
+
+
+@njit(cache=True, fastmath=True)
+def davis_accel(v, A0, B1, C2, inv_mass):
+    """Davis 저항 F = A0 + B1*v + C2*v^2 [N] 을 가속도로 환산 (Horner 형태)"""
+    if v < 0.01:  # 매우 낮은 속도에서는 저항 무시
+        return 0.0
+    return -(A0 + v * (B1 + C2 * v)) * inv_mass
+
+
+@njit(cache=True, fastmath=True)
+def grade_accel(grade_percent):
+    return -9.81 * (grade_percent / 100.0)
+
+
+@njit(cache=True, fastmath=True)
+def blend_w_regen(v):
+    """재생 제동 혼합 비율: 20 km/h 이상 1.0, 8 km/h 이하 0.0, 사이는 선형"""
+    if v >= _V_KMH_20:
+        return 1.0
+    if v <= _V_KMH_8:
+        return 0.0
+    return (v * 3.6 - 8.0) / 12.0
+
+
+def adhesion_limited_brake(base, a_cap, scale):
+    """노치 기본 제동 가속도(base, 음수)를 점착 한계(a_cap, 음수)로 제한; 한계에 걸리면 a_cap*scale"""
+    a_eff = max(base, a_cap)
+    if a_eff <= a_cap + 1e-6:
+        a_eff = a_cap * scale
+    return a_eff
+
+
+@njit(cache=True, fastmath=True)
+def effective_brake_accel(a_lowv, a_highv, v):
+    """점착 한계 반영된 노치 제동 가속도(v<=8 / v>8 테이블 값)에 저속 페이드를 반영"""
+    a_eff = a_highv if v > 8.0 else a_lowv
+
+    # 🚃 Low-speed brake fade: 0 km/h 50% → 5 km/h 100% 선형
+    if v < _V_KMH_5:
+        a_eff *= 0.5 + 0.5 * (v * 3.6 / 5.0)
+    return a_eff
+
+
+# 제동 1차 응답 시정수 테이블: [속도 구간*2 + 완해 여부] (인가=0, 완해=1)
+_TAU_ELEC = (0.18, 0.40,    # 15 km/h 이상
+             0.30, 0.50)    # 15 km/h 미만
+_TAU_AIR = (0.30, 0.60,     # 10 km/h 이상
+            0.45, 0.75,     # 10 km/h 미만
+            0.15, 0.45)     # EB (속도 무관)
+# 필터 계수 alpha = dt/tau 에서 나눗셈을 없애기 위한 역수 테이블 (모든 tau > 0)
+_INV_TAU_ELEC = tuple(1.0 / t for t in _TAU_ELEC)
+_INV_TAU_AIR = tuple(1.0 / t for t in _TAU_AIR)
+
+
+@njit(cache=True, fastmath=True)
+def brake_alpha(v, is_eb, e_apply, a_apply, dt):
+    """회생/공기 제동 1차 필터 계수 (dt/tau_e, dt/tau_a). e_apply/a_apply: 명령이 현재 값보다 강함(인가 중)"""
+    inv_e = _INV_TAU_ELEC[(2 if v < _V_KMH_15 else 0) + (0 if e_apply else 1)]
+    inv_a = _INV_TAU_AIR[(4 if is_eb else (2 if v < _V_KMH_10 else 0)) + (0 if a_apply else 1)]
+    return dt * inv_e, dt * inv_a
+
+
+@njit(cache=True, fastmath=True)
+def brake_split_step(a_total_cmd, v, is_eb, dt, brk_elec, brk_air):
+    """회생/공기 제동 분배 + 1차 응답 필터 한 스텝. (brk_elec, brk_air) 반환"""
+    w = blend_w_regen(v)
+    a_cmd_e = a_total_cmd * w
+    a_cmd_a = a_total_cmd * (1.0 - w)
+    alpha_e, alpha_a = brake_alpha(v, is_eb, a_cmd_e < brk_elec, a_cmd_a < brk_air, dt)
+    brk_elec += (a_cmd_e - brk_elec) * alpha_e
+    brk_air += (a_cmd_a - brk_air) * alpha_a
+    return brk_elec, brk_air
+
+
+# WSP 상태 (numba nopython에서 문자열 비교를 피하기 위해 int 사용)
+WSP_NORMAL, WSP_RELEASE, WSP_REAPPLY = 0, 1, 2
+
+
+@njit(cache=True, fastmath=True)
+def wsp_step(state, timer, a_demand, v, a_cap, dt):
+    """활주방지(WSP) 상태기계 한 스텝. (state, timer, 제한된 제동 가속도) 반환
+    a_cap: 점착 한계 제동 가속도 (-0.85·μ·g, 런마다 고정이라 호출측에서 미리 계산)"""
+    margin = 0.05
+    if state == WSP_NORMAL:
+        if a_demand < (a_cap - margin) and v > _V_KMH_3:
+            return WSP_RELEASE, 0.12, min(a_demand, 0.5 * a_cap)
+        return state, timer, a_demand
+    elif state == WSP_RELEASE:
+        timer -= dt
+        if timer <= 0.0:
+            return WSP_REAPPLY, 0.15, min(a_demand, 0.3 * a_cap)
+        return state, timer, min(a_demand, 0.3 * a_cap)
+    else:
+        timer -= dt
+        if timer <= 0.0:
+            return WSP_NORMAL, timer, min(a_demand, 0.8 * a_cap)
+        return state, timer, min(a_demand, 0.8 * a_cap)
+
+
+@njit(cache=True, fastmath=True)
+def stop_distance_rollout(notch, v, a, brk_elec, brk_air, wsp_state, wsp_timer, a_cmd_filt,
+                          rem_now, a_lowv, a_highv, is_eb, a_cap, a_grade,
+                          A0, B1, C2, inv_mass, tau_brk, j_max):
+    """현재 상태에서 notch(제동/N)를 유지했을 때의 정지거리 롤아웃 (최대 72초 시뮬레이션).
+    a_lowv/a_highv: 해당 노치의 점착 한계 반영 제동 가속도 테이블 값
+    기본 dt=0.03, 필터가 수렴한 정상 감속 구간(10 km/h 이상, WSP 정상)은 5스텝 묶음(0.15초)으로 진행"""
+    dt_fine = 0.03
+    n_coarse = 5                    # 정상 구간에서 한 번에 묶는 기본 스텝 수
+    dt_coarse = dt_fine * n_coarse
+    s = 0.0
+    limit = rem_now + 8.0
+    t_left = 72.0                   # 최대 롤아웃 시간 (기존 2400 × 0.03초)
+
+    # 루프 불변값은 미리 계산
+    inv_tau_brk = 1.0 / max(1e-6, tau_brk)
+    # 묶음 스텝의 위치 증분이 기본 스텝 n번과 같도록 하는 계수 (등가속 가정): Δs = n·v·dt + a·dt²·n(n+2)/2
+    s_acc_coarse = dt_fine * dt_fine * n_coarse * (n_coarse + 2) * 0.5
+    coarse = False
+    a_target_prev = 0.0
+    n_stuck = 0                     # 속도 변화가 사라진 연속 스텝 수
+
+    while t_left > 0.0:
+        dt = dt_coarse if coarse else dt_fine
+        v_kmh = v * 3.6
+        a_cmd_total = effective_brake_accel(a_lowv, a_highv, v) if notch > 0 else 0.0
+
+        w = blend_w_regen(v)
+        a_cmd_e = a_cmd_total * w
+        a_cmd_a = a_cmd_total * (1.0 - w)
+
+        alpha_e, alpha_a = brake_alpha(v, is_eb, a_cmd_e < brk_elec, a_cmd_a < brk_air, dt)
+
+        brk_elec += (a_cmd_e - brk_elec) * alpha_e
+        brk_air  += (a_cmd_a - brk_air ) * alpha_a
+        a_brake = brk_elec + brk_air
+
+        # 활주방지: step()과 같은 int 상태기계 커널 사용
+        wsp_state, wsp_timer, a_brake = wsp_step(wsp_state, wsp_timer, a_brake, v, a_cap, dt)
+
+        a_davis = davis_accel(v, A0, B1, C2, inv_mass)
+        a_target = a_brake + a_grade + a_davis  # 제동/N 노치 전용 (동력 없음)
+
+        if notch == 0:
+            a_target = a_grade + a_davis
+
+        # E233계열은 회생제동 우선 제어 방식을 사용하며, 속도 약 7~10 km/h 이하에서 회생제동이 실질적으로 사라집니다.
+
+        # 이때 공기제동이 완전히 takeover
+        # 공기압 밸브 제어에 따른 지연이 필연적으로 존재합니다.
+        # 일반적으로 응답상수 τ ≈ 0.5초 내외로 알려져 있습니다.
+
+        # 반면 회생제동의 경우 전류 제어 응답이 수백 ms(0.2~0.3s) 수준이라
+        # 체감상 약 1.5~2배 느리다고 볼 수 있습니다.
+
+        # 제동력 자체는 저속 시 마찰제동의 압력 제한 및 마찰계수 변화로 인해
+        # 약 0.7~0.8배 수준으로 감소합니다.
+
+        # # (신규) 속도 기반 소프트 스톱
+        rem_pred = max(0.0, rem_now - s)
+        # v_kmh = v * 3.6
+        # if v_kmh <= soft_stop_di and notch > 0:
+        #     alpha = max(0.0, min(1.0, v_kmh / soft_stop_di))
+        #     a_soft = (-0.30) * alpha + (soft_stop_const) * (1.0 - alpha)
+        #     w_soft = 1.0 - alpha
+        #     a_target = (1.0 - w_soft) * a_target + w_soft * a_soft
+
+        ### NEW NEW NEW
+        # if notch == 1 or rem_pred <= 0.0:
+        #     a_target = min(a_target, 0.0)
+
+        # # 응답시간(tau_brk)을 저속에서 늘려서 밸브 지연 반영
+        # v_kmh_local = v * 3.6
+        # effective_tau_brk = self.veh.tau_brk * 1.5 if v_kmh_local <= air_brake_vi else self.veh.tau_brk
+
+        # a_cmd_filt += (a_target - a_cmd_filt) * (dt / max(1e-6, effective_tau_brk))
+        ### NEW NEW NEW
+
+        if notch == 1 or rem_pred <= 0.0:
+            a_target = min(a_target, 0.0)
+
+        a_cmd_filt += (a_target - a_cmd_filt) * (dt * inv_tau_brk)
+
+        max_da = j_max * dt
+        if v_kmh <= 5.0:
+            scale = 0.25 + 0.75 * (v_kmh / 5.0)
+            max_da *= scale
+
+        da = a_cmd_filt - a
+        if da > max_da:
+            da = max_da
+        elif da < -max_da:
+            da = -max_da
+        a += da
+
+        v_prev = v
+        if coarse:
+            s += n_coarse * v * dt_fine + a * s_acc_coarse
+            v = max(0.0, v + a * dt)
+        else:
+            v = max(0.0, v + a * dt)
+            s += v * dt + 0.5 * a * dt * dt
+        t_left -= dt
+
+        if v <= 0.01:
+            break
+        if s > limit:
+            break
+        # 사실상 정지(0.5 km/h 미만)인데 감속이 거의 없으면 더 굴려도 의미 있는 이동이 없음
+        if v_kmh < 0.5 and a > -0.02:
+            break
+        # 속도가 10스텝 연속 그대로이고 스텝당 이동이 1cm 미만이면 정체 상태로 보고 종료
+        if abs(v - v_prev) < 1e-6 and v * dt < 0.01:
+            n_stuck += 1
+            if n_stuck >= 10:
+                break
+        else:
+            n_stuck = 0
+
+        # 명령 필터·저크 제한이 수렴했고 저속/WSP 과도 구간이 아니면 다음은 묶음 스텝
+        # (목표 가속도 자체가 속도에 따라 빠르게 변하는 구간은 필터 지연이 dt에 민감하므로 제외)
+        coarse = (abs(a_cmd_e - brk_elec) < 0.005 and abs(a_cmd_a - brk_air) < 0.005
+                  and abs(a_target - a_cmd_filt) < 0.005 and abs(da) < 0.5 * max_da
+                  and abs(a_target - a_target_prev) < 2e-4 * dt
+                  and v_kmh >= 10.0 and wsp_state == WSP_NORMAL)
+        a_target_prev = a_target
+
+    return s
+
+
+# fastmath 없음: 건너뛴 후보를 inf로 돌려주므로 (fastmath는 inf/nan이 없다고 가정해 비교를 접을 수 있음).
+# 무거운 루프는 stop_distance_rollout 쪽이라 여기서 fastmath를 빼도 비용 차이 없음
+@njit(cache=True)
+def stop_distance_rollout3(n0, n1, n2, lut_lowv, lut_highv, eb_notch,
+                           v, a, brk_elec, brk_air, wsp_state, wsp_timer, a_cmd_filt,
+                           rem_now, a_cap, a_grade, A0, B1, C2, inv_mass, tau_brk, j_max):
+    """같은 초기 상태에서 노치 후보 최대 3개를 한 번의 호출로 롤아웃.
+    lut_lowv/lut_highv: 노치별 제동 테이블, 음수 노치는 건너뜀(inf)"""
+    out = [math.inf, math.inf, math.inf]
+    notches = (n0, n1, n2)
+    for i in range(3):
+        n = notches[i]
+        if n < 0:
+            continue
+        if 0 < n < len(lut_lowv):
+            a_lowv = lut_lowv[n]
+            a_highv = lut_highv[n]
+        else:
+            a_lowv = 0.0
+            a_highv = 0.0
+        out[i] = stop_distance_rollout(
+            n, v, a, brk_elec, brk_air, wsp_state, wsp_timer, a_cmd_filt,
+            rem_now, a_lowv, a_highv, n == eb_notch, a_cap, a_grade,
+            A0, B1, C2, inv_mass, tau_brk, j_max)
+    return out[0], out[1], out[2]
+
+
+@njit(cache=True, fastmath=True)
+def longitudinal_step(a_cmd_brake, pwr_accel, eff_notch, is_eb, v, a,
+                      brk_elec, brk_air, wsp_state, wsp_timer, a_cmd_filt,
+                      a_cap, a_grade, A0, B1, C2, inv_mass, inv_tau_brk, j_max, dt):
+    """step()의 종방향 동역학 한 스텝: 제동 분배/응답 → WSP → 합성 가속도 → 명령 필터 → 저크 제한 → 속도 적분.
+    (a, v, brk_elec, brk_air, wsp_state, wsp_timer, a_cmd_filt) 반환. 위치/이동 방향은 호출측(기어 상태)에서 처리"""
+    brk_elec, brk_air = brake_split_step(a_cmd_brake, v, is_eb, dt, brk_elec, brk_air)
+    wsp_state, wsp_timer, a_brake = wsp_step(wsp_state, wsp_timer, brk_elec + brk_air, v, a_cap, dt)
+
+    a_target = pwr_accel + a_brake + a_grade + davis_accel(v, A0, B1, C2, inv_mass)
+    if eff_notch >= 1:
+        a_target = min(a_target, 0.0)
+
+    # 가속도 필터 (tau_brk 사용)
+    a_cmd_filt += (a_target - a_cmd_filt) * (dt * inv_tau_brk)
+
+    # 저크 제한 (저속/브레이크 상황에서는 완화)
+    v_kmh = v * 3.6
+    max_da = j_max * dt
+    if v_kmh <= 5.0 and eff_notch >= 1:
+        max_da *= 0.25 + 0.75 * (v_kmh / 5.0)
+
+    da = a_cmd_filt - a
+    if da > max_da:
+        da = max_da
+    elif da < -max_da:
+        da = -max_da
+    a += da
+
+    v = max(0.0, v + a * dt)
+    return a, v, brk_elec, brk_air, wsp_state, wsp_timer, a_cmd_filt
+
+
+# ------------------------------------------------------------
+# Power model (compute_power_accel용 테이블과 커널)
+# ------------------------------------------------------------
+
+# 노치별 실측 데이터 (P1~P13): (견인력 비율, 정토크 끝 km/h, taper 시작 km/h, cut km/h)
+POWER_NOTCH_DATA = (
+    (0.45,  10,  20, 30),
+    (1.00,  25,  60, 70),
+    (1.00,  35, 100, 110),
+    (1.00,  55, 140, 150),
+    (1.00,  75, 180, 190),
+    (1.00,  95, 210, 220),
+    (1.00, 115, 240, 250),
+    (1.00, 135, 265, 270),
+    (1.00, 150, 280, 285),
+    (1.00, 165, 295, 300),
+    (1.00, 180, 320, 325),
+    (1.00, 190, 345, 350),
+    (1.00, 200, 362, 365),
+)
+
+# 물리 파라미터 없는 차량용 노치별 fade: (plateau 끝 km/h, exponential 시작 km/h, 최솟값)
+LEGACY_POWER_FADE = (
+    (5.0, 30.0, 0.0003),
+    (20.0, 33.0, 0.04),
+    (32.0, 54.0, 0.07),
+    (33.0, 54.0, 0.14),
+    (33.0, 54.0, 0.27),
+)
+
+
+@njit(cache=True, fastmath=True)
+def power_accel_traction(lever_notch, v, T_max_N, mass_kg, a_max):
+    """견인력/출력 제한 모델 동력 가속도 (T_max_kN > 0 차량, lever_notch < 0: P1~)"""
+    # [Data] 노치별 실측 데이터: 모듈 상수 POWER_NOTCH_DATA (P1~P13, 범위 밖은 클램프)
+    current_notch = min(-lever_notch, len(POWER_NOTCH_DATA))
+    ratio_force, v_corner_kmh, v_taper_kmh, v_cut_kmh = POWER_NOTCH_DATA[current_notch - 1]
+
+    # ------------------------------------------------------------------
+    # [Physics] 1단계: 기본 견인력 (정토크/정출력)
+    # ------------------------------------------------------------------
+    v_kmh = v * 3.6
+    v_safe = max(0.1, v)
+
+    F_constant_torque = T_max_N * ratio_force
+
+    if v_kmh <= v_corner_kmh:
+        F_physics = F_constant_torque
+    else:
+        v_corner_ms = v_corner_kmh / 3.6
+        power_at_corner = F_constant_torque * v_corner_ms
+        F_physics = power_at_corner / v_safe
+
+    # ------------------------------------------------------------------
+    # [Limit] 2단계: N700S 스타일 'Holding' 제어 (수정된 부분)
+    # Cut 속도에서 힘을 0으로 끄지 않고, 저항을 이길 만큼만 살짝 남김
+    # ------------------------------------------------------------------
+    
+    # [Tuning] 잔류 동력 비율 (0.0 ~ 1.0)
+    # 고속일수록 공기저항이 세므로, 계산된 힘의 10~15% 정도는 남겨야 속도가 유지됨
+    # Notch가 낮을수록(저속) 비율을 낮추고, 높을수록 높이는 동적 할당도 가능
+    if lever_notch >= -2:
+        residual_ratio = 0.10
+    elif lever_notch >= -4:
+        residual_ratio = 0.25
+    elif lever_notch >= -6:
+        residual_ratio = 0.40
+    else:
+        residual_ratio = 0.50  
+        
+
+    if v_kmh >= v_cut_kmh:
+        # [Cruising 구간]
+        # 목표 속도 도달 시: 0으로 끄지 않고 잔류 동력만 유지
+        
+        # 안전 장치: Cut 속도를 5km/h 이상 과하게 초과하면 그때는 진짜 차단(내리막 등)
+
+        F_physics *= residual_ratio
+        
+    elif v_kmh > v_taper_kmh:
+        # [Taper 구간]
+        # 기존: 100% -> 0% 로 감소
+        # 변경: 100% -> residual_ratio(15%) 로 부드럽게 안착
+        
+        range_width = v_cut_kmh - v_taper_kmh
+        if range_width > 0:
+            # progress: 0.0 (진입) ~ 1.0 (Cut도달)
+            progress = (v_kmh - v_taper_kmh) / range_width
+            
+            # 선형 보간 (Lerp): 1.0 에서 residual_ratio 로 이동
+            # 식: Start - (progress * (Start - End))
+            factor = 1.0 - (progress * (1.0 - residual_ratio))
+            
+            F_physics *= factor
+    
+    # ------------------------------------------------------------------
+    # [Finalize] 가속도 변환
+    # ------------------------------------------------------------------
+    a_pwr = F_physics / mass_kg
+
+    # (선택) 극저속 넛지 (필요 시 주석 해제)
+    # if v_kmh < 5.0:
+    #      a_pwr = max(a_pwr, 0.05 * ratio_force)
+
+    if a_max > 0:
+        a_pwr = min(a_pwr, a_max)
+
+    return a_pwr
+
+
+@njit(cache=True, fastmath=True)
+def power_accel_fade(idx, base_accel, v, maxSpeed_kmh):
+    """물리 파라미터 없는 차량: 노치 idx(0=P1)의 고정 가속도 base_accel에 속도 fade 적용"""
+    v_kmh = v * 3.6
+    max_v_kmh = max(1.0, maxSpeed_kmh)
+
+    # 노치별 plateau 종료, exponential 시작, min_factor (모듈 상수 LEGACY_POWER_FADE)
+    # idx가 테이블 범위를 넘어가면 마지막 값 사용
+    s_k, e_k, min_factor = LEGACY_POWER_FADE[min(idx, len(LEGACY_POWER_FADE) - 1)]
+
+    # mid_factor는 linear 구간 중간값
+    mid_factor = 0.35 + 0.1 * idx
+    mid_factor = min(1.0, max(min_factor, mid_factor))
+
+    # ----- Region 1+2: plateau + linear decay -----
+    # t를 [0, 1]로 clip하면 plateau(t=0 → 1.0)와 linear 구간이 한 식으로 합쳐짐
+    if v_kmh <= e_k:
+        t = min(1.0, max(0.0, (v_kmh - s_k) / max(1e-6, (e_k - s_k))))
+        factor = 1.0 - (1.0 - mid_factor) * t
+
+    # ----- Region 3: exponential tail -----
+    else:
+        t = (v_kmh - e_k) / max(1e-6, (max_v_kmh - e_k))
+        factor = (mid_factor - min_factor) * math.exp(-3.0 * t) + min_factor
+
+    # min_factor 보장 + 상한 1.0
+    return base_accel * min(1.0, max(min_factor, factor))
+
+
 # ------------------------------------------------------------
 # Simulator
 # ------------------------------------------------------------
 
+# 노치 값을 받는 명령: notch_history/_notch_runs가 array("b")라 정수만 넣을 수 있다
+_NOTCH_COMMANDS = frozenset({"stepNotch", "setNotch", "setInternalNotch"})
+
+
+def _notch_value(val) -> Optional[int]:
+    """클라이언트가 보낸 노치 값 → int (2.0, "3" 허용). 숫자가 아니거나 유한하지 않으면 None"""
+    try:
+        n = float(val)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(n):
+        return None
+    return int(n)
+
+
 class StoppingSim:
     def __init__(self, veh: Vehicle, scn: Scenario):
 
@@ -256,11 +794,16 @@ class StoppingSim:
         self.veh = veh
         self.scn = scn
         self.state = State(t=0.0, s=0.0, v=scn.v0, a=0.0, lever_notch=0, internal_notch=0, finished=False)
+        # sim_loop 깨우기용: 정지/일시정지 중에는 폴링하지 않고 이 이벤트를 기다린다
+        self._run_event = asyncio.Event()
+        # 설정 명령 묶음(연속 setMu/setLoadRate 등)을 한 번의 reset()으로 합치기 위한 플래그
+        self._reset_pending = False
         self.running = False
         self.random_mode = False  # Flag to control game-over behavior in Random Scenario mode
         self.final_notch_on_finish = 0  # Store notch when simulation finishes for random mode reload
         self.vref = build_vref(scn.L, 0.8 * veh.a_max)
-        self._cmd_queue = deque()
+        self._cmd_queue = deque()  # (적용 시각, name, val) 튜플; tau_cmd가 고정이라 시각 순으로 쌓임
+        self._next_cmd_t = float("inf")  # 큐 선두 명령의 적용 시각 (비어 있으면 inf)
 
         # 초기 제동(B1/B2) 판정
         self.first_brake_start: Optional[float] = None
@@ -271,16 +814,17 @@ class StoppingSim:
         self.first_brake_start_t: Optional[float] = None
         self.seen_zero_notch: bool = False # NOTCH_HISTORY[0] == 0 보장용
 
-        # 기록
-        self.notch_history: List[int] = []
-        self.time_history: List[float] = []
+        # 기록 (array: 원소당 1/8바이트, 박싱 없는 연속 버퍼)
+        self.notch_history = array("b")  # int8 노치
+        self.time_history = array("d")   # float64 시각
+        self._notch_runs = array("b")    # notch_history에서 연속 중복을 제거한 노치 변화열 (계단 패턴 판정용)
 
         # EB 사용 여부
         self.eb_used = False
         self.run_over = False
         # 저크 계산
         self.prev_a = 0.0
-        self.jerk_history: List[float] = []
+        self.jerk_history = self._new_jerk_history()
 
         # ---------- TASC ----------``
         self.tasc_enabled = False
@@ -302,13 +846,9 @@ class StoppingSim:
         # μ-저항 분리: rr_factor는 항상 1.0로 고정(μ와 무관)
         self.rr_factor = 1.0
 
-        # ---- 성능 최적화: TASC 예측 캐시/스로틀 ----
-        self._tasc_pred_cache = {
-            "t": -1.0, "v": -1.0, "notch": -1,
-            "s_cur": float('inf'), "s_up": float('inf'), "s_dn": float('inf')
-        }
+        # ---- 성능 최적화: TASC 예측 캐시/스로틀 (dict 대신 slots 객체) ----
+        self._tasc_cache = TascPredCache()
         self._tasc_pred_interval = 0.1  # 100ms - 더 효율적인 재계산 간격
-        self._tasc_last_pred_t = -1.0
         self._tasc_speed_eps = 0.5  # m/s - 캐시 유효성 범위 확대
 
         # ---- B5 필요 여부 캐시/스로틀 ----
@@ -339,7 +879,7 @@ class StoppingSim:
         self.tau_apply_eb = 0.15
         self.tau_release_lowv = 0.8
 
-        self.wsp_state = "normal"
+        self.wsp_state = WSP_NORMAL
         self.wsp_timer = 0.0
 
         self._a_cmd_filt = 0.0  # 명령 가속도 1차 필터
@@ -368,6 +908,7 @@ class StoppingSim:
         self.timer_norm_L = 300.0          # m 스케일
         # 기준점에서 멀면 공식기반과 블렌딩
         self.timer_blend_threshold = 1.5   # 정규화 거리 기준
+        self._rebuild_timer_calib_cache()
 
         # ▼ 극단값/이상치 처리용 가드레일
         self.timer_min_s = 5.0
@@ -384,6 +925,8 @@ class StoppingSim:
         # 입력 보정 기록(클라이언트에 안내용)
         self.last_input_sanitized = {}
 
+        self._refresh_physics_cache()
+
     def _tasc_relax_margin_for_notch(self, notch: int) -> float:
         """
         노치에 따라 동적으로 릴렉스 마진을 반환.
@@ -418,22 +961,35 @@ class StoppingSim:
         if norm_L is not None: self.timer_norm_L = float(norm_L)
         if idw_power is not None: self.timer_idw_power = float(idw_power)
         if blend_threshold is not None: self.timer_blend_threshold = float(blend_threshold)
+        self._rebuild_timer_calib_cache()
+
+    def _rebuild_timer_calib_cache(self):
+        """IDW에 쓰는 보정점/정규화 역수/거듭제곱을 미리 풀어 둔다 (보정 표 변경 시 호출)"""
+        eps = 1e-6
+        self._calib_pts = tuple((p["v"], p["L"], p["t"]) for p in self.timer_calib)
+        self._calib_inv_nv = 1.0 / max(eps, self.timer_norm_v)
+        self._calib_inv_nL = 1.0 / max(eps, self.timer_norm_L)
+        self._calib_neg_p = -self.timer_idw_power
 
     def _idw_predict_time(self, v_kmh: float, L_m: float) -> Tuple[float, float]:
         """보정 표 기반 IDW 추정. (예상시간, 기준점까지의 최소 정규화거리) 반환"""
-        if not self.timer_calib:
+        if not self._calib_pts:
             return float("nan"), float("inf")
         eps = 1e-6
+        inv_nv = self._calib_inv_nv
+        inv_nL = self._calib_inv_nL
+        neg_p = self._calib_neg_p
         num = 0.0
         den = 0.0
         min_d = float("inf")
-        for p in self.timer_calib:
-            dv = (v_kmh - p["v"]) / max(eps, self.timer_norm_v)
-            dL = (L_m   - p["L"]) / max(eps, self.timer_norm_L)
-            d = (dv*dv + dL*dL) ** 0.5
-            min_d = min(min_d, d)
-            w = 1.0 / ((d + eps) ** self.timer_idw_power)
-            num += w * p["t"]
+        for pv, pL, pt in self._calib_pts:
+            dv = (v_kmh - pv) * inv_nv
+            dL = (L_m - pL) * inv_nL
+            d = math.sqrt(dv*dv + dL*dL)
+            if d < min_d:
+                min_d = d
+            w = (d + eps) ** neg_p
+            num += w * pt
             den += w
         t_idw = num / max(eps, den)
         return t_idw, min_d
@@ -502,95 +1058,53 @@ class StoppingSim:
  
     def _effective_brake_accel(self, notch: int, v: float) -> float:
         #  악셀(음수) 또는 N(0)에서는 '브레이크 없음'
-        if notch <= 0:
-            return 0.0
-
-        if notch >= len(self.veh.notch_accels):
+        if notch <= 0 or notch >= len(self._brake_eff_lowv):
             return 0.0
 
-        # 기본 제동 가속도(음수)
-        base = float(self.veh.notch_accels[notch]) # 음수여야 정상(제동)
-        k_srv = 0.85
-        k_eb = 0.98
-        is_eb = (notch == self.veh.notches - 1)
-        k_adh = k_eb if is_eb else k_srv
-        a_cap = -k_adh * float(self.scn.mu) * 9.81 # 음수
-
-        a_eff = max(base, a_cap)
-        if a_eff <= a_cap + 1e-6:
-            scale = 0.90 if v > 8.0 else 0.85
-            a_eff = a_cap * scale
-        
-        # 🚃 Low-speed brake fade: linearly reduce from 100% at 5 km/h to 10% at 0 km/h
-        v_kmh = v * 3.6
-        if v_kmh < 5.0:
-            # Linear interpolation: 50% at 0 km/h, 100% at 5 km/h
-            low_speed_factor = 0.5 + 0.5 * (v_kmh / 5.0)
-            a_eff *= low_speed_factor
-        
-        return a_eff
-
-    def _grade_accel(self) -> float:
-        return -9.81 * (self.scn.grade_percent / 100.0)
+        # 노치별 점착 한계 반영 제동 가속도는 _refresh_physics_cache에서 미리 계산
+        return effective_brake_accel(self._brake_eff_lowv[notch], self._brake_eff_highv[notch], v)
+
+    def _refresh_physics_cache(self):
+        """스텝 간 불변인 Davis/구배/점착 상수를 미리 계산.
+        차량(질량·Davis 계수·노치 테이블), rr_factor, 구배, μ가 바뀐 뒤 호출해야 한다 (reset()은 자동 호출)."""
+        # 구배는 시나리오 단위 상수(위치별 프로파일 없음) → 스칼라 하나로 충분 (s 기반 LUT 불필요)
+        # Davis는 v에 대한 2차식이라 곱셈 2번: 속도 LUT보다 직접 계산이 빠르고 보간 오차도 없음
+        rr = self.rr_factor
+        self._davis_cached = (self.veh.A0 * rr, self.veh.B1 * rr, self.veh.C2, 1.0 / self.veh.mass_kg)
+        self._a_grade = grade_accel(self.scn.grade_percent)
+        mu = float(self.scn.mu)
+        self._a_cap = -0.85 * mu * 9.81  # WSP 점착 한계
+        self._inv_tau_brk = 1.0 / max(1e-6, self.veh.tau_brk)  # 명령 필터 계수 = dt * _inv_tau_brk
+
+        # 노치별 제동 테이블 (인덱스=노치): 점착 한계(EB만 0.98, 나머지 0.85) 반영 후
+        # 한계에 걸린 노치는 v>8 m/s에서 0.90배, 이하에서 0.85배
+        eb = self.veh.notches - 1
+        self._eb_notch = eb
+        self._max_normal_notch = eb - 1  # EB 직전
+        base = [float(a) for a in self.veh.notch_accels]
+        caps = [-(0.98 if i == eb else 0.85) * mu * 9.81 for i in range(len(base))]
+        self._brake_eff_lowv = tuple(adhesion_limited_brake(b, c, 0.85) for b, c in zip(base, caps))
+        self._brake_eff_highv = tuple(adhesion_limited_brake(b, c, 0.90) for b, c in zip(base, caps))
+
+        # 스냅샷의 정적 필드 (L/구배/차량이 바뀌는 경로는 모두 reset() 또는 이 함수를 거침)
+        self._snap_static = {
+            "L": self.scn.L,
+            "grade_percent": self.scn.grade_percent,
+            "grade": self.scn.grade_percent,
+            "train_name": self.veh.name,
+            "maxSpeed_kmh": self.veh.maxSpeed_kmh,
+        }
 
     def _davis_accel(self, v: float) -> float:
-        """Davis 저항을 가속도로 환산 (A0/B1/C2는 차량 객체의 최신값 사용) - 최적화"""
-        if v < 0.01:  # 매우 낮은 속도에서는 저항 무시
-            return 0.0
-        A0 = self.veh.A0 * self.rr_factor
-        B1 = self.veh.B1 * self.rr_factor
-        C2 = self.veh.C2
-        v_sq = v * v  # 한 번만 계산
-        F = A0 + B1 * v + C2 * v_sq  # N
-        return -F / self.veh.mass_kg
+        """Davis 저항을 가속도로 환산 (_refresh_physics_cache 시점의 A0/B1/C2 사용)"""
+        A0, B1, C2, inv_m = self._davis_cached
+        return davis_accel(v, A0, B1, C2, inv_m)
 
     # ----------------- 기타 헬퍼 -----------------
 
     def _blend_w_regen(self, v: float) -> float:
-        """재생 에너지 혼합 비율 (최적화: 3.6 곱셈 1회만)"""
-        v_kmh = v * 3.6
-        if v_kmh >= 20.0: 
-            return 1.0
-        if v_kmh <= 8.0:  
-            return 0.0
-        return (v_kmh - 8.0) / 12.0
-
-    def _update_brake_dyn_split(self, a_total_cmd: float, v: float, is_eb: bool, dt: float):
-        w = self._blend_w_regen(v)
-        a_cmd_e = a_total_cmd * w
-        a_cmd_a = a_total_cmd * (1.0 - w)
-        tau_e_apply, tau_e_rel = (0.18, 0.40) if v * 3.6 >= 15 else (0.30, 0.50)
-        tau_a_apply, tau_a_rel = (0.45, 0.75) if v * 3.6 < 10 else (0.30, 0.60)
-        if is_eb:
-            tau_a_apply, tau_a_rel = 0.15, 0.45
-        e_stronger = (a_cmd_e < self.brk_elec)
-        a_stronger = (a_cmd_a < self.brk_air)
-        tau_e = tau_e_apply if e_stronger else tau_e_rel
-        tau_a = tau_a_apply if a_stronger else tau_a_rel
-        self.brk_elec += (a_cmd_e - self.brk_elec) * (dt / max(1e-6, tau_e))
-        self.brk_air  += (a_cmd_a - self.brk_air ) * (dt / max(1e-6, tau_a))
-        self.brk_accel = self.brk_elec + self.brk_air
-
-    def _wsp_update(self, v: float, a_demand: float, dt: float):
-        a_cap = -0.85 * self.scn.mu * 9.81
-        margin = 0.05
-        if self.wsp_state == "normal":
-            if a_demand < (a_cap - margin) and v * 3.6 > 3.0:
-                self.wsp_state = "release"
-                self.wsp_timer = 0.12
-                return min(a_demand, 0.5 * a_cap)
-            return a_demand
-        elif self.wsp_state == "release":
-            self.wsp_timer -= dt
-            if self.wsp_timer <= 0.0:
-                self.wsp_state = "reapply"
-                self.wsp_timer = 0.15
-            return min(a_demand, 0.3 * a_cap)
-        else:
-            self.wsp_timer -= dt
-            if self.wsp_timer <= 0.0:
-                self.wsp_state = "normal"
-            return min(a_demand, 0.8 * a_cap)
+        """재생 에너지 혼합 비율"""
+        return blend_w_regen(v)
 
     # ----------------- Controls -----------------
     # safe-guard for notch limits
@@ -598,7 +1112,7 @@ class StoppingSim:
         # forward_notches 길이만큼 음수 허용
         min_notch = -len(self.veh.forward_notch_accels)  # 예: -2
         max_notch = len(self.veh.notch_accels) - 2       # EB 직전 (W/S로는 EB 도달 불가)
-        return max(min_notch, min(max_notch, n))
+        return max(min_notch, min(max_notch, int(n)))
 
 
     def queue_command(self, name: str, val: int = 0):
@@ -609,22 +1123,29 @@ class StoppingSim:
         # takes effect without waiting tau_brk.
         # if name == "setInternalNotch":
         #     # Internal notch changes are immediate and do not queue
-        #     cmd = {"t": self.state.t, "name": name, "val": val}
+        #     cmd = (self.state.t, name, val)
         #     self._apply_command(cmd)
         #     return
         if name == "atcOverspeed":
             self.state.atc_overspeed = bool(val)
             return
 
+        if name in _NOTCH_COMMANDS:
+            n = _notch_value(val)
+            if n is None:
+                logger.debug("Ignored %s with non-numeric value %r", name, val)
+                return
+            val = n
+
         if name == "emergencyBrake":
             # Apply immediately
-            cmd = {"t": self.state.t, "name": name, "val": val}
+            cmd = (self.state.t, name, val)
             self._apply_command(cmd)
 
             # If Emergency Brake was set, force brake states to commanded values
             try:
                 st = self.state
-                if st.lever_notch == (self.veh.notches - 1):
+                if st.lever_notch == self._eb_notch:
                     a_cmd_total = self._effective_brake_accel(st.lever_notch, st.v)
                     w = self._blend_w_regen(st.v)
                     # Split into electric/air immediately to skip slower tau_brk
@@ -635,7 +1156,7 @@ class StoppingSim:
                     self._a_cmd_filt = a_cmd_total
             except Exception:
                 # Be defensive: if anything goes wrong, fall back to queued behavior
-                self._cmd_queue.append({"t": self.state.t + self.veh.tau_cmd, "name": name, "val": val})
+                self._push_command(name, val)
             return
 
         # Normal commands respect command latency
@@ -658,16 +1179,33 @@ class StoppingSim:
         if immediate_apply:
             # apply immediately but DO NOT queue a duplicate entry
             # to avoid double-applying the command (fixes double-notch bug)
-            cmd = {"t": self.state.t, "name": name, "val": val}
+            cmd = (self.state.t, name, val)
             self._apply_command(cmd)
             return
 
-        self._cmd_queue.append({"t": self.state.t + self.veh.tau_cmd, "name": name, "val": val})
+        self._push_command(name, val)
 
-    def _apply_command(self, cmd: dict):
+    def _push_command(self, name: str, val: int):
+        """tau_cmd 지연 후 적용될 명령을 큐에 넣고 다음 적용 시각을 갱신"""
+        t_apply = self.state.t + self.veh.tau_cmd
+        self._cmd_queue.append((t_apply, name, val))
+        if t_apply < self._next_cmd_t:
+            self._next_cmd_t = t_apply
+
+    def drain_applicable_commands(self) -> int:
+        """적용 시각이 지난 대기 명령을 모두 적용하고 다음 적용 시각을 갱신. 적용 후 lever_notch 반환"""
+        st = self.state
+        t = st.t
+        q = self._cmd_queue
+        apply = self._apply_command
+        while q and q[0][0] <= t:
+            apply(q.popleft())
+        self._next_cmd_t = q[0][0] if q else float("inf")
+        return st.lever_notch
+
+    def _apply_command(self, cmd: tuple):
         st = self.state
-        name = cmd["name"]
-        val = cmd["val"]
+        _, name, val = cmd
 
         # # ▼ TASC가 'active'인 상태에서 수동 개입이 들어오면 즉시 TASC를 OFF
         # if self.tasc_enabled and self.tasc_active and name in ("emergencyBrake"):
@@ -681,12 +1219,11 @@ class StoppingSim:
         if name == "stepNotch":
             old_notch = st.lever_notch
             st.lever_notch = self._clamp_notch(st.lever_notch + val)
-            if DEBUG:
-                print(f"Applied stepNotch: {old_notch} -> {st.lever_notch}")
+            logger.debug("Applied stepNotch: %s -> %s", old_notch, st.lever_notch)
         elif name == "release":
             st.lever_notch = 0
         elif name == "emergencyBrake":
-            st.lever_notch = self.veh.notches - 1
+            st.lever_notch = self._eb_notch
             if st.v > 0:
                 self.eb_used = True
         elif name == "setNotch":
@@ -701,7 +1238,32 @@ class StoppingSim:
 
     # ----------------- Lifecycle -----------------
 
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    @running.setter
+    def running(self, value: bool):
+        self._running = value
+        if value:
+            self.wake()
+
+    def wake(self):
+        """대기 중인 sim_loop가 상태(running/paused)를 다시 확인하도록 깨운다"""
+        self._run_event.set()
+
+    def request_reset(self):
+        """reset()을 예약한다. 실제 리셋은 flush_pending_reset()에서 한 번만 수행"""
+        self._reset_pending = True
+
+    def flush_pending_reset(self):
+        """예약된 reset()이 있으면 지금 수행한다"""
+        if self._reset_pending:
+            self._reset_pending = False
+            self.reset()
+
     def reset(self):
+        self._reset_pending = False
         # ▼ 기존 상태의 timer_enabled를 보존(없으면 False)
         prev_timer_enabled = getattr(self.state, "timer_enabled", False)
         # ▼ 기존 running 상태를 보존 (UI 명령이 random mode 상태 변경 시 중단되지 않도록)
@@ -716,14 +1278,11 @@ class StoppingSim:
             max_normal_notch = self.veh.notches - 2  # EB 직전
             if prev_lever_notch >= self.veh.notches - 1:  # EB인 경우
                 prev_lever_notch = max_normal_notch  # EB를 최대 일반 노치로 변환
-                if DEBUG:
-                    print(f"[RESET] EB detected in final_notch_on_finish, converting to max normal notch ({max_normal_notch})")
-            if DEBUG:
-                print(f"[RESET] *** RANDOM MODE NOTCH PRESERVATION: Using final_notch_on_finish={prev_lever_notch}")
+                logger.debug("[RESET] EB detected in final_notch_on_finish, converting to max normal notch (%s)", max_normal_notch)
+            logger.debug("[RESET] *** RANDOM MODE NOTCH PRESERVATION: Using final_notch_on_finish=%s", prev_lever_notch)
         else:
             prev_lever_notch = 0
-            if DEBUG:
-                print(f"[RESET] Normal reset: lever_notch starting at 0 (random_mode={self.random_mode})")
+            logger.debug("[RESET] Normal reset: lever_notch starting at 0 (random_mode=%s)", self.random_mode)
 
         # 계획 속도는 시나리오의 v0를 따로 들고 있고, 대기 상태에는 v=0으로 둔다
         self._planned_v0 = self.scn.v0
@@ -739,6 +1298,7 @@ class StoppingSim:
         else:
             self.running = prev_running
         self._cmd_queue.clear()
+        self._next_cmd_t = float("inf")
 
         self.first_brake_start = None
         self.first_brake_done = False
@@ -746,11 +1306,12 @@ class StoppingSim:
         self.first_brake_start_t = None
         self.seen_zero_notch = False
         self.eb_used = False
-        self.notch_history.clear()
-        self.time_history.clear()
+        del self.notch_history[:]
+        del self.time_history[:]
+        del self._notch_runs[:]
 
         self.prev_a = 0.0
-        self.jerk_history = []
+        self.jerk_history = self._new_jerk_history()
 
         # self.manual_override = False
         self._tasc_last_change_t = 0.0
@@ -761,11 +1322,7 @@ class StoppingSim:
         self.tasc_active = False
         self.tasc_armed = bool(self.tasc_enabled)
 
-        self._tasc_pred_cache.update({
-            "t": -1.0, "v": -1.0, "notch": -1,
-            "s_cur": float('inf'), "s_up": float('inf'), "s_dn": float('inf')
-        })
-        self._tasc_last_pred_t = -1.0
+        self._clear_tasc_pred_cache()
 
         self._need_b5_last_t = -1.0
         self._need_b5_last = False
@@ -774,7 +1331,7 @@ class StoppingSim:
         self.brk_elec = 0.0
         self.brk_air  = 0.0
 
-        self.wsp_state = "normal"
+        self.wsp_state = WSP_NORMAL
         self.wsp_timer = 0.0
 
         self._a_cmd_filt = 0.0
@@ -785,6 +1342,7 @@ class StoppingSim:
         self.pwr_rampup_progress = 0.0
 
         self.rr_factor = 1.0
+        self._refresh_physics_cache()
 
         # ▼ 보존해 둔 타이머 플래그 복원
         self.state.timer_enabled = prev_timer_enabled
@@ -798,22 +1356,20 @@ class StoppingSim:
             self.state.time_remaining_s = 0.0
 
         # ▼ 정수 표시 초기화
-        self.state.time_remaining_int = math.floor(self.state.time_remaining_s)
+        self.state.time_remaining_int = int(self.state.time_remaining_s)
         self.state.time_overrun_s = 0.0
         self.state.time_overrun_int = 0
         self.state.time_overrun_started = False
 
-        if DEBUG:
-            print(f"Simulation reset | timer_enabled={self.state.timer_enabled} "
-                  f"| budget={self.state.time_budget_s:.2f}s | L={self.scn.L} v0={self.scn.v0*3.6:.1f}km/h")
+        logger.debug("Simulation reset | timer_enabled=%s | budget=%.2fs | L=%s v0=%.1fkm/h",
+                     self.state.timer_enabled, self.state.time_budget_s, self.scn.L, self.scn.v0*3.6)
 
     def start(self):
         self.reset()
         self.state.v = float(self._planned_v0) 
         self.running = True
         self._t_start = time.time()  # sim_loop에서 참조 가능
-        if DEBUG:
-            print("Simulation started")
+        logger.debug("Simulation started")
 
 
     def compute_power_accel(self, lever_notch: int, v: float) -> float:
@@ -829,104 +1385,9 @@ class StoppingSim:
             return 0.0
 
         if self.veh.T_max_kN > 0.0:
-            # ------------------------------------------------------------------
-            # [Data] 노치별 실측 데이터 (수정 없음)
-            # ------------------------------------------------------------------
-            notch_data = {
-                1:  (0.45,  10,  20, 30),
-                2:  (1.00,  25,  60, 70),
-                3:  (1.00,  35, 100, 110),
-                4:  (1.00,  55, 140, 150),
-                5:  (1.00,  75, 180, 190),
-                6:  (1.00,  95, 210, 220),
-                7:  (1.00, 115, 240, 250),
-                8:  (1.00, 135, 265, 270),
-                9:  (1.00, 150, 280, 285),
-                10: (1.00, 165, 295, 300),
-                11: (1.00, 180, 320, 325),
-                12: (1.00, 190, 345, 350),
-                13: (1.00, 200, 362, 365)
-            }
-
-            current_notch = abs(lever_notch)
-            if current_notch not in notch_data:
-                current_notch = max(1, min(current_notch, 13))
-
-            ratio_force, v_corner_kmh, v_taper_kmh, v_cut_kmh = notch_data[current_notch]
-
-            # ------------------------------------------------------------------
-            # [Physics] 1단계: 기본 견인력 (정토크/정출력)
-            # ------------------------------------------------------------------
-            v_kmh = v * 3.6
-            v_safe = max(0.1, v)
-            T_max_N = self.veh.T_max_kN * 1000.0
-            mass_kg = self.veh.mass_kg
-
-            F_constant_torque = T_max_N * ratio_force
-
-            if v_kmh <= v_corner_kmh:
-                F_physics = F_constant_torque
-            else:
-                v_corner_ms = v_corner_kmh / 3.6
-                power_at_corner = F_constant_torque * v_corner_ms
-                F_physics = power_at_corner / v_safe
-
-            # ------------------------------------------------------------------
-            # [Limit] 2단계: N700S 스타일 'Holding' 제어 (수정된 부분)
-            # Cut 속도에서 힘을 0으로 끄지 않고, 저항을 이길 만큼만 살짝 남김
-            # ------------------------------------------------------------------
-            
-            # [Tuning] 잔류 동력 비율 (0.0 ~ 1.0)
-            # 고속일수록 공기저항이 세므로, 계산된 힘의 10~15% 정도는 남겨야 속도가 유지됨
-            # Notch가 낮을수록(저속) 비율을 낮추고, 높을수록 높이는 동적 할당도 가능
-            if lever_notch >= -2:
-                residual_ratio = 0.10
-            elif lever_notch >= -4:
-                residual_ratio = 0.25
-            elif lever_notch >= -6:
-                residual_ratio = 0.40
-            else:
-                residual_ratio = 0.50  
-                
-
-            if v_kmh >= v_cut_kmh:
-                # [Cruising 구간]
-                # 목표 속도 도달 시: 0으로 끄지 않고 잔류 동력만 유지
-                
-                # 안전 장치: Cut 속도를 5km/h 이상 과하게 초과하면 그때는 진짜 차단(내리막 등)
-
-                F_physics *= residual_ratio
-                
-            elif v_kmh > v_taper_kmh:
-                # [Taper 구간]
-                # 기존: 100% -> 0% 로 감소
-                # 변경: 100% -> residual_ratio(15%) 로 부드럽게 안착
-                
-                range_width = v_cut_kmh - v_taper_kmh
-                if range_width > 0:
-                    # progress: 0.0 (진입) ~ 1.0 (Cut도달)
-                    progress = (v_kmh - v_taper_kmh) / range_width
-                    
-                    # 선형 보간 (Lerp): 1.0 에서 residual_ratio 로 이동
-                    # 식: Start - (progress * (Start - End))
-                    factor = 1.0 - (progress * (1.0 - residual_ratio))
-                    
-                    F_physics *= factor
-            
-            # ------------------------------------------------------------------
-            # [Finalize] 가속도 변환
-            # ------------------------------------------------------------------
-            a_pwr = F_physics / mass_kg
-
-            # (선택) 극저속 넛지 (필요 시 주석 해제)
-            # if v_kmh < 5.0:
-            #      a_pwr = max(a_pwr, 0.05 * ratio_force)
-
-            if hasattr(self.veh, 'a_max') and self.veh.a_max > 0:
-                a_pwr = min(a_pwr, self.veh.a_max)
-
-            return a_pwr
-            
+            return power_accel_traction(
+                lever_notch, v, self.veh.T_max_kN * 1000.0,
+                float(self.veh.mass_kg), float(self.veh.a_max))
 
         # ------------------------
         # 2) 물리 파라미터 없으면 기존 방식 유지 여기서 단 조절!!!
@@ -936,228 +1397,79 @@ class StoppingSim:
         idx = max(0, min(-lever_notch - 1, n_notches - 1))
         base_accel = float(self.veh.forward_notch_accels[idx])
 
-        v_kmh = v * 3.6
-        max_v_kmh = max(1.0, float(self.veh.maxSpeed_kmh))
-
-        # 노치별 plateau 종료, exponential 시작, min_factor
-        flat_ends   = [5.0, 20.0, 32.0, 33.0, 33.0]         # plateau 끝
-        exp_starts  = [30.0, 33.0, 54.0, 54.0, 54.0]       # exponential 시작
-        min_factors = [0.0003, 0.04, 0.07, 0.14, 0.27]  # 노치별 최솟값
-
-        # idx가 배열 범위를 넘어가면 마지막 값 사용
-        s_k = flat_ends[min(idx, len(flat_ends)-1)]
-        e_k = exp_starts[min(idx, len(exp_starts)-1)]
-        min_factor = min_factors[min(idx, len(min_factors)-1)]
-
-        # mid_factor는 linear 구간 중간값
-        mid_factor = 0.35 + 0.1 * idx
-        mid_factor = min(1.0, max(min_factor, mid_factor))
-
-        # ----- Region 1: plateau -----
-        if v_kmh <= s_k:
-            factor = 1.0
-
-        # ----- Region 2: linear decay -----
-        elif v_kmh <= e_k:
-            t = (v_kmh - s_k) / max(1e-6, (e_k - s_k))
-            factor = 1.0 - (1.0 - mid_factor) * t
-            factor = max(factor, min_factor)  # linear에서도 min_factor 보장
-
-        # ----- Region 3: exponential tail -----
-        else:
-            t = (v_kmh - e_k) / max(1e-6, (max_v_kmh - e_k))
-            factor = (mid_factor - min_factor) * (2.71828 ** (-3 * t)) + min_factor
-            factor = max(factor, min_factor)
-
-        factor = min(1.0, factor)  # 상한 1.0
-        return base_accel * factor
+        return power_accel_fade(idx, base_accel, v, float(self.veh.maxSpeed_kmh))
 
 
     def eb_used_from_history(self) -> bool:
-        return any(n == self.veh.notches - 1 for n in self.notch_history)
+        return self._eb_notch in self._notch_runs
 
     # ------ stopping distance helpers ------
 
-    def _estimate_stop_distance(self, notch: int, v0: float) -> float:
-        # if notch <= 0:
-        #     return float('inf')
-
-
-
-        dt = 0.03
+    def _estimate_stop_distances(self, n0: int, n1: int, n2: int, v0: float):
+        """노치 후보 3개(음수는 건너뜀 → inf)를 유지할 때 현재 상태에서의 예상 정지거리 [m] + 제어 지연 여유.
+        롤아웃 본체는 stop_distance_rollout3 커널 (제동/N 노치 전용)"""
+        st = self.state
         v = max(0.0, v0)
-        a = float(self.state.a)
-        s = 0.0
-
-
-
-        brk_elec = float(self.brk_elec)
-        brk_air  = float(self.brk_air)
-        wsp_state = self.wsp_state
-        wsp_timer = float(self.wsp_timer)
-        a_cmd_filt = float(self._a_cmd_filt)
-
-        rem_now = self.scn.L - self.state.s
-        limit = float(rem_now + 8.0)
-
         ctrl_delay = max(self._tasc_pred_interval, self.tasc_hold_min_s)
         latency_margin = v * ctrl_delay
+        A0, B1, C2, inv_m = self._davis_cached
+
+        s0, s1, s2 = stop_distance_rollout3(
+            n0, n1, n2, self._brake_eff_lowv, self._brake_eff_highv, self._eb_notch,
+            v, float(st.a), float(self.brk_elec), float(self.brk_air),
+            self.wsp_state, float(self.wsp_timer), float(self._a_cmd_filt),
+            float(self.scn.L - st.s), self._a_cap, self._a_grade, A0, B1, C2, inv_m,
+            float(self.veh.tau_brk), float(self.veh.j_max),
+        )
+        return s0 + latency_margin, s1 + latency_margin, s2 + latency_margin
 
-        for _ in range(2400):
-
-                                # 동력 가속도 계산 (전진 notch)
-            if notch < 0:  # P1~P5
-                pwr_accel = self.compute_power_accel(notch, v)
-            else:
-                pwr_accel = 0.0
-            is_eb = (notch == self.veh.notches - 1)
-            a_cmd_total = self._effective_brake_accel(notch, v)
-
-            w = self._blend_w_regen(v)
-            a_cmd_e = a_cmd_total * w
-            a_cmd_a = a_cmd_total * (1.0 - w)
-
-            tau_e_apply, tau_e_rel = (0.18, 0.40) if v * 3.6 >= 15 else (0.30, 0.50)
-            tau_a_apply, tau_a_rel = (0.45, 0.75) if v * 3.6 < 10 else (0.30, 0.60)
-            if is_eb:
-                tau_a_apply, tau_a_rel = 0.15, 0.45
-
-            e_stronger = (a_cmd_e < brk_elec)
-            a_stronger = (a_cmd_a < brk_air)
-
-            tau_e = tau_e_apply if e_stronger else tau_e_rel
-            tau_a = tau_a_apply if a_stronger else tau_a_rel
-
-            brk_elec += (a_cmd_e - brk_elec) * (dt / max(1e-6, tau_e))
-            brk_air  += (a_cmd_a - brk_air ) * (dt / max(1e-6, tau_a))
-            a_brake = brk_elec + brk_air
-
-            a_cap = -0.85 * self.scn.mu * 9.81
-            margin = 0.05
-            if wsp_state == "normal":
-                if a_brake < (a_cap - margin) and v * 3.6 > 3.0:
-                    wsp_state = "release"
-                    wsp_timer = 0.12
-                    a_brake = min(a_brake, 0.5 * a_cap)
-            elif wsp_state == "release":
-                wsp_timer -= dt
-                if wsp_timer <= 0.0:
-                    wsp_state = "reapply"
-                    wsp_timer = 0.15
-                a_brake = min(a_brake, 0.3 * a_cap)
-            else:
-                wsp_timer -= dt
-                if wsp_timer <= 0.0:
-                    wsp_state = "normal"
-                    wsp_timer = 0.0
-                a_brake = min(a_brake, 0.8 * a_cap)
-
-            a_grade = self._grade_accel()
-            a_davis = self._davis_accel(v)
-            a_target = pwr_accel + a_brake + a_grade + a_davis
-
-            if notch == 0:
-                a_target = self._grade_accel() + self._davis_accel(v)
-
-            # E233계열은 회생제동 우선 제어 방식을 사용하며, 속도 약 7~10 km/h 이하에서 회생제동이 실질적으로 사라집니다.
-
-            # 이때 공기제동이 완전히 takeover
-            # 공기압 밸브 제어에 따른 지연이 필연적으로 존재합니다.
-            # 일반적으로 응답상수 τ ≈ 0.5초 내외로 알려져 있습니다.
-
-            # 반면 회생제동의 경우 전류 제어 응답이 수백 ms(0.2~0.3s) 수준이라
-            # 체감상 약 1.5~2배 느리다고 볼 수 있습니다.
-
-            # 제동력 자체는 저속 시 마찰제동의 압력 제한 및 마찰계수 변화로 인해
-            # 약 0.7~0.8배 수준으로 감소합니다.
-
-            # # (신규) 속도 기반 소프트 스톱
-            rem_pred = max(0.0, rem_now - s)
-            # v_kmh = v * 3.6
-            # if v_kmh <= soft_stop_di and notch > 0:
-            #     alpha = max(0.0, min(1.0, v_kmh / soft_stop_di))
-            #     a_soft = (-0.30) * alpha + (soft_stop_const) * (1.0 - alpha)
-            #     w_soft = 1.0 - alpha
-            #     a_target = (1.0 - w_soft) * a_target + w_soft * a_soft
-
-            ### NEW NEW NEW
-            # if notch == 1 or rem_pred <= 0.0:
-            #     a_target = min(a_target, 0.0)
-
-            # # 응답시간(tau_brk)을 저속에서 늘려서 밸브 지연 반영
-            # v_kmh_local = v * 3.6
-            # effective_tau_brk = self.veh.tau_brk * 1.5 if v_kmh_local <= air_brake_vi else self.veh.tau_brk
-
-            # a_cmd_filt += (a_target - a_cmd_filt) * (dt / max(1e-6, effective_tau_brk))
-            ### NEW NEW NEW
-
-            if notch == 1 or rem_pred <= 0.0:
-                a_target = min(a_target, 0.0)
-
-            a_cmd_filt += (a_target - a_cmd_filt) * (dt / max(1e-6, self.veh.tau_brk))
-
-            max_da = self.veh.j_max * dt
-            v_kmh = v * 3.6
-            if v_kmh <= 5.0:
-                scale = 0.25 + 0.75 * (v_kmh / 5.0)
-                max_da *= scale
-
-            da = a_cmd_filt - a
-            if da > max_da:
-                da = max_da
-            elif da < -max_da:
-                da = -max_da
-            a += da
-
-            v = max(0.0, v + a * dt)
-            s += v * dt + 0.5 * a * dt * dt
-
-            if v <= 0.01:
-                break
-            if s > limit:
-                break
-
-        return s + latency_margin
+    def _estimate_stop_distance(self, notch: int, v0: float) -> float:
+        return self._estimate_stop_distances(notch, -1, -1, v0)[0]
 
     def _stopping_distance(self, notch: int, v: float) -> float:
         if notch <= 0:
             return float('inf')
         return self._estimate_stop_distance(notch, v)
 
-    def _tasc_predict(self, cur_notch: int, v: float):
-        """TASC 정지거리 예측 (최적화된 캐싱)"""
+    def _clear_tasc_pred_cache(self):
+        """TASC 예측 캐시 무효화 (다음 _tasc_predict에서 반드시 재계산)"""
+        c = self._tasc_cache
+        c.valid_until = -1.0
+        c.v = -1.0
+        c.notch = -1
+        c.has_cur = False
+        c.s_cur = float('inf')
+        c.s_dn = float('inf')
+
+    def _tasc_predict(self, cur_notch: int, v: float, need_cur: bool = True):
+        """TASC 정지거리 예측 (최적화된 캐싱). (s_cur, s_dn) 반환.
+        제어기가 쓰는 것만 롤아웃: build 단계는 현재/하향 노치, relax 단계(need_cur=False)는 하향 노치만"""
         st = self.state
-        need = False
-        # 캐시 유효성 검사 - 간격 기반
-        if (st.t - self._tasc_last_pred_t) >= self._tasc_pred_interval:
-            need = True
-        # 속도 변화 감지
-        if abs(v - self._tasc_pred_cache["v"]) >= self._tasc_speed_eps:
-            need = True
-        # 노치 변화 감지
-        if cur_notch != self._tasc_pred_cache["notch"]:
-            need = True
-        
-        # 캐시 유효 - 재계산 스킵
-        if not need:
-            return (
-                self._tasc_pred_cache["s_cur"],
-                self._tasc_pred_cache["s_up"],
-                self._tasc_pred_cache["s_dn"],
-            )
+        c = self._tasc_cache
+        # 캐시 유효: 유효 시각 이전 + 같은 노치 + 속도 변화가 작음 (+ 필요한 값이 계산돼 있음) → 재계산 스킵
+        if (st.t < c.valid_until
+                and cur_notch == c.notch
+                and abs(v - c.v) < self._tasc_speed_eps
+                and (c.has_cur or not need_cur)):
+            return c.s_cur, c.s_dn
 
         # 필요한 경우에만 계산 (100ms마다 최대 1회)
-        max_normal_notch = self.veh.notches - 2
-        s_cur = self._stopping_distance(cur_notch, v) if cur_notch > 0 else float("inf")
-        s_up = self._stopping_distance(cur_notch + 1, v) if cur_notch + 1 <= max_normal_notch else 0.0
-        s_dn = self._stopping_distance(cur_notch - 1, v) if cur_notch - 1 >= 1 else float("inf")
+        # 한 번의 커널 호출로 롤아웃 (-1 = 건너뜀 → inf)
+        s_cur, _, s_dn = self._estimate_stop_distances(
+            cur_notch if need_cur and cur_notch > 0 else -1,
+            -1,
+            cur_notch - 1 if cur_notch - 1 >= 1 else -1,
+            v,
+        )
 
         # 캐시 업데이트
-        self._tasc_pred_cache.update(
-            {"t": st.t, "v": v, "notch": cur_notch, "s_cur": s_cur, "s_up": s_up, "s_dn": s_dn}
-        )
-        self._tasc_last_pred_t = st.t
-        return s_cur, s_up, s_dn
+        c.v = v
+        c.notch = cur_notch
+        c.has_cur = need_cur
+        c.s_cur = s_cur
+        c.s_dn = s_dn
+        c.valid_until = st.t + self._tasc_pred_interval
+        return s_cur, s_dn
 
     def _need_B5_now(self, v: float, remaining: float) -> bool:
         st = self.state
@@ -1182,16 +1494,74 @@ class StoppingSim:
 
     # ----------------- Main step -----------------
 
+    def _tasc_control(self, st: State):
+        """TASC 정위치 정지 제어 한 스텝 (tasc_enabled일 때만 step()에서 호출)"""
+        dwell_ok = (st.t - self._tasc_last_change_t) >= self.tasc_hold_min_s
+        rem_now = self.scn.L - st.s
+        cur = st.internal_notch
+        max_normal_notch = self._max_normal_notch
+
+        if self.tasc_armed and not self.tasc_active:
+            takeover_on = self.tasc_takeover_rem_m
+            hyst = self.tasc_takeover_hyst_m
+            if rem_now <= (takeover_on + hyst):
+                self.tasc_active = True
+                self.tasc_armed = False
+                self._tasc_last_change_t = st.t
+
+        if self.tasc_active:
+            if not self.first_brake_done:
+                self.first_brake_done = True
+            else:
+                # relax 단계에서는 s_cur를 보지 않으므로 하향 노치만 예측
+                s_cur, s_dn = self._tasc_predict(cur, st.v, self._tasc_phase == "build")
+                changed = False
+                if self._tasc_phase == "build":
+                    if cur < max_normal_notch and s_cur > (rem_now - self.tasc_deadband_m):
+                        if dwell_ok:
+                            st.internal_notch = self._clamp_notch(cur + 1)
+                            self._tasc_last_change_t = st.t
+                            self._tasc_peak_notch = max(self._tasc_peak_notch, st.internal_notch)
+                            changed = True
+                    else:
+                        self._tasc_phase = "relax"
+                if self._tasc_phase == "relax" and not changed:
+                    # if cur > 1 and s_dn <= (rem_now + self.tasc_deadband_m):
+                    #     if dwell_ok:
+                    #         st.internal_notch = self._clamp_notch(cur - 1)
+                    #         self._tasc_last_change_t = st.t
+                    if cur > 1:
+                        target_notch = cur - 1
+                        # 변경: "릴렉스되어 내려갈 목표 노치(target_notch)가 4 이상"일 때만 마진/홀드를 적용
+                        # (즉, 5→4, 6→5 처럼 결과가 여전히 4 이상인 경우에만 지연)
+                        if cur >= test_notch:
+                            # 더 보수적으로 완화하려면 추가 마진 요구
+                            margin = self._tasc_relax_margin_for_notch(cur)
+                            relax_allowed = (s_dn <= (rem_now + self.tasc_deadband_m - margin))
+                            time_since_change = st.t - self._tasc_last_change_t
+                            if relax_allowed and dwell_ok and (time_since_change >= self.tasc_relax_hold_s):
+                                st.internal_notch = self._clamp_notch(target_notch)
+                                self._tasc_last_change_t = st.t
+                        else:
+                            # 목표 노치가 3 이하(3,2,1 등)면 기존 즉시 완화 규칙 유지
+                            if s_dn <= (rem_now + self.tasc_deadband_m) and dwell_ok:
+                                st.internal_notch = self._clamp_notch(target_notch)
+                                self._tasc_last_change_t = st.t
+
     def step(self):
         st = self.state
         dt = self.scn.dt
 
-        while self._cmd_queue and self._cmd_queue[0]["t"] <= st.t:
-            self._apply_command(self._cmd_queue.popleft())
-        
+        # 명령은 드물게 들어오므로 다음 적용 시각 전에는 큐를 보지 않는다
+        if st.t >= self._next_cmd_t:
+            self.drain_applicable_commands()
+
         # if self.notch_history[-1] != st.lever_notch:
         if st.v > 0.1:
             self.notch_history.append(st.lever_notch)
+            runs = self._notch_runs
+            if not runs or runs[-1] != st.lever_notch:
+                runs.append(st.lever_notch)
 
         self.time_history.append(st.t)
 
@@ -1228,8 +1598,10 @@ class StoppingSim:
         # ▼ 타이머(카운트다운): 0 아래로도 계속 진행 - 최적화
         if st.timer_enabled and not st.finished:
             st.time_remaining_s -= dt
-            # 정수 표시값은 0.01초마다만 업데이트 (불필요한 계산 감소)
-            st.time_remaining_int = int(st.time_remaining_s)
+            # 정수 표시값은 값이 바뀔 때만 갱신 (초당 1회)
+            ri = int(st.time_remaining_s)
+            if ri != st.time_remaining_int:
+                st.time_remaining_int = ri
             if st.time_remaining_s < 0.0 and not st.time_overrun_started:
                 st.time_overrun_s = -st.time_remaining_s
                 st.time_overrun_int = abs(st.time_remaining_int)
@@ -1238,57 +1610,9 @@ class StoppingSim:
                 st.issues["timeout_started"] = True
 
         # ---------- TASC ----------
-        if self.tasc_enabled and not st.finished:
-            dwell_ok = (st.t - self._tasc_last_change_t) >= self.tasc_hold_min_s
-            rem_now = self.scn.L - st.s
-            cur = st.internal_notch
-            max_normal_notch = self.veh.notches - 2
-
-            if self.tasc_armed and not self.tasc_active:
-                takeover_on = self.tasc_takeover_rem_m
-                hyst = self.tasc_takeover_hyst_m
-                if rem_now <= (takeover_on + hyst):
-                    self.tasc_active = True
-                    self.tasc_armed = False
-                    self._tasc_last_change_t = st.t
-
-            if self.tasc_active:
-                if not self.first_brake_done:
-                    self.first_brake_done = True
-                else:
-                    s_cur, s_up, s_dn = self._tasc_predict(cur, st.v)
-                    changed = False
-                    if self._tasc_phase == "build":
-                        if cur < max_normal_notch and s_cur > (rem_now - self.tasc_deadband_m):
-                            if dwell_ok:
-                                st.internal_notch = self._clamp_notch(cur + 1)
-                                self._tasc_last_change_t = st.t
-                                self._tasc_peak_notch = max(self._tasc_peak_notch, st.internal_notch)
-                                changed = True
-                        else:
-                            self._tasc_phase = "relax"
-                    if self._tasc_phase == "relax" and not changed:
-                        # if cur > 1 and s_dn <= (rem_now + self.tasc_deadband_m):
-                        #     if dwell_ok:
-                        #         st.internal_notch = self._clamp_notch(cur - 1)
-                        #         self._tasc_last_change_t = st.t
-                        if cur > 1:
-                            target_notch = cur - 1
-                            # 변경: "릴렉스되어 내려갈 목표 노치(target_notch)가 4 이상"일 때만 마진/홀드를 적용
-                            # (즉, 5→4, 6→5 처럼 결과가 여전히 4 이상인 경우에만 지연)
-                            if cur >= test_notch:
-                                # 더 보수적으로 완화하려면 추가 마진 요구
-                                margin = self._tasc_relax_margin_for_notch(cur)
-                                relax_allowed = (s_dn <= (rem_now + self.tasc_deadband_m - margin))
-                                time_since_change = st.t - self._tasc_last_change_t
-                                if relax_allowed and dwell_ok and (time_since_change >= self.tasc_relax_hold_s):
-                                    st.internal_notch = self._clamp_notch(target_notch)
-                                    self._tasc_last_change_t = st.t
-                            else:
-                                # 목표 노치가 3 이하(3,2,1 등)면 기존 즉시 완화 규칙 유지
-                                if s_dn <= (rem_now + self.tasc_deadband_m) and dwell_ok:
-                                    st.internal_notch = self._clamp_notch(target_notch)
-                                    self._tasc_last_change_t = st.t
+        # (finished면 위에서 이미 return; 비활성 시에는 이 분기 하나만 비용)
+        if self.tasc_enabled:
+            self._tasc_control(st)
         # ---------- Dynamics ----------
 
         # internal_notch가 더 높으면 그것을 사용
@@ -1346,43 +1670,17 @@ class StoppingSim:
             self.pwr_rampup_progress = 0.0
             pwr_accel = pwr_accel_raw
 
+        # 제동 분배/WSP/저항/필터/저크 제한/속도 적분은 커널 한 번 호출로 (스칼라 상태만 주고받음)
         a_cmd_brake = self._effective_brake_accel(effective_notch, st.v)
-        is_eb = (effective_notch == self.veh.notches - 1)
-        self._update_brake_dyn_split(a_cmd_brake, st.v, is_eb, dt)
-        a_brake = self._wsp_update(st.v, self.brk_accel, dt)
-        a_grade = self._grade_accel()
-        a_davis = self._davis_accel(st.v)
-
-        # 최종 가속도 계산 (순차 누적)
-        a_target = pwr_accel + a_brake + a_grade + a_davis
-
-        rem_now = self.scn.L - st.s
-        v_kmh = st.v * 3.6
-
-        if effective_notch >= 1:
-            a_target = min(a_target, 0.0)
-
-        # 가속도 필터 (tau_brk 사용)
-        tau_inv = dt / max(1e-6, self.veh.tau_brk)
-        self._a_cmd_filt += (a_target - self._a_cmd_filt) * tau_inv
-
-        # 저크 제한 (jerk limiting)
-        max_da = self.veh.j_max * dt
-        # 저속/브레이크 상황에서 저크 제한 완화
-        if v_kmh <= 5.0 and effective_notch >= 1:
-            scale = 0.25 + 0.75 * (v_kmh / 5.0)
-            max_da *= scale
-
-        # 가속도 변화 클램핑
-        da = self._a_cmd_filt - st.a
-        if da > max_da:
-            da = max_da
-        elif da < -max_da:
-            da = -max_da
-        st.a += da
-
-        # 물리 적분
-        st.v = max(0.0, st.v + st.a * dt)
+        A0, B1, C2, inv_m = self._davis_cached
+        (st.a, st.v, self.brk_elec, self.brk_air,
+         self.wsp_state, self.wsp_timer, self._a_cmd_filt) = longitudinal_step(
+            a_cmd_brake, float(pwr_accel), effective_notch, effective_notch == self._eb_notch,
+            float(st.v), float(st.a), float(self.brk_elec), float(self.brk_air),
+            self.wsp_state, float(self.wsp_timer), float(self._a_cmd_filt),
+            self._a_cap, self._a_grade, A0, B1, C2, inv_m,
+            self._inv_tau_brk, float(self.veh.j_max), dt)
+        self.brk_accel = self.brk_elec + self.brk_air
         # F/R 기어에서 가속 시 이동 방향 설정 (N에서는 유지)
         if st.gear == "F" and st.lever_notch < 0 and pwr_accel > 0:
             st.move_direction = 1
@@ -1433,7 +1731,9 @@ class StoppingSim:
                 st.issues["stop_not_b1"] = True
                 st.issues["stop_not_b1_msg"] = "정차 시 B3 이상으로 정차함 - 승차감 불쾌"
 
-            if self.is_stair_pattern(self.notch_history):
+            # 노치 변화열은 step()에서 누적해 둔 것 사용 (전체 이력 재순회 없음)
+            stair_ok = self.is_stair_pattern(self._notch_runs)
+            if stair_ok:
                 score += 300
             else:
                 if self.tasc_enabled and not self.manual_override:
@@ -1447,7 +1747,7 @@ class StoppingSim:
                 score += 500
 
             st.issues["early_brake_too_short"] = not self.first_brake_done
-            st.issues["step_brake_incomplete"] = not self.is_stair_pattern(self.notch_history)
+            st.issues["step_brake_incomplete"] = not stair_ok
             st.issues["stop_error_m"] = st.stop_error_m
 
             jerk = abs((st.a - self.prev_a) / dt)
@@ -1507,17 +1807,21 @@ class StoppingSim:
                 self.tasc_active = False
                 self._tasc_phase = "build"
                 self._tasc_peak_notch = 1
-                if DEBUG:
-                    print("[FINISH] TASC restored for next run (random_mode + tasc_enabled_initially)")
+                logger.debug("[FINISH] TASC restored for next run (random_mode + tasc_enabled_initially)")
             
             # In Random Scenario mode, keep running=True so physics can continue after finish
             # (waiting for advanceStation command). In normal mode, stop the simulation.
             if not self.random_mode:
                 self.running = False
-            if DEBUG:
-                print(f"Avg jerk: {avg_jerk:.4f}, jerk_score: {jerk_score:.2f}, final score: {score}")
-                print(f"Simulation finished: stop_error={st.stop_error_m:.3f} m, score={score}")
-                print(f"[FINISH] Preserving final notch: {self.final_notch_on_finish} (random_mode={self.random_mode})")
+            logger.debug("Avg jerk: %.4f, jerk_score: %.2f, final score: %s", avg_jerk, jerk_score, score)
+            logger.debug("Simulation finished: stop_error=%.3f m, score=%s", st.stop_error_m, score)
+            logger.debug("[FINISH] Preserving final notch: %s (random_mode=%s)", self.final_notch_on_finish, self.random_mode)
+
+    def step_many(self, n: int):
+        """n개의 고정 스텝(scn.dt)을 한 번의 호출로 진행 (sim_loop 호출 오버헤드 절감)"""
+        step = self.step
+        for _ in range(n):
+            step()
 
     def remove_negative_values(self, notches: List[int]) -> List[int]:
         """마지막 음수 값 뒤에 있는 모든 수 반환, 음수가 없으면 원본 리스트 반환"""
@@ -1566,11 +1870,14 @@ class StoppingSim:
 
         return True
 
+    _JERK_WINDOW_S = 1.0  # 저크 채점 창 (최근 1초)
+
+    def _new_jerk_history(self) -> deque:
+        """최근 _JERK_WINDOW_S 분량만 유지하는 고정 크기 링 버퍼 (오래된 값은 자동으로 밀려남)"""
+        return deque(maxlen=max(1, int(self._JERK_WINDOW_S / self.scn.dt)))
+
     def compute_jerk_score(self):
-        dt = self.scn.dt
-        window_time = 1.0
-        n = int(window_time / dt)
-        recent_jerks = self.jerk_history[-n:] if len(self.jerk_history) >= n else self.jerk_history
+        recent_jerks = self.jerk_history  # 이미 최근 창만 남아 있음
         if not recent_jerks:
             return 0.0, 0
 
@@ -1596,51 +1903,56 @@ class StoppingSim:
 
 
     def snapshot(self):
+        """전체 스냅샷 (정적 필드 + 매 틱 바뀌는 필드)"""
+        snap = self._snap_static.copy()
+        snap.update(self.snapshot_dynamic())
+        snap["server_ts_ns"] = time.monotonic_ns()  # 보간용 서버 타임스탬프 (단조 시계, 정수 ns)
+        return snap
+
+    def snapshot_dynamic(self):
+        """매 틱 바뀔 수 있는 필드만. 정적 필드(_snap_static)는 브로드캐스트가 바뀔 때만 따로 비교/전송.
+        server_ts_ns는 넣지 않는다: 매번 달라져 delta가 비지 않으므로 브로드캐스트가 보낼 프레임에만 붙인다.
+        매번 새 dict: 브로드캐스트가 직전 스냅샷을 보관해 delta를 계산하므로 제자리 수정은 불가"""
         st = self.state
-        return {
-            "t": round(st.t, 3),
-            "server_ts": time.time(),  # 보간용 서버 타임스탬프
-            "s": st.s,
-            "v": st.v,
-            "a": st.a,
-            "lever_notch": st.lever_notch,
-            "gear": st.gear,  # "F" or "R"
-            "remaining_m": self.scn.L - st.s,
-            "L": self.scn.L,
-            "v_ref": self.vref(st.s),
-            "finished": st.finished,
-            "stop_error_m": st.stop_error_m,
-            "residual_speed_kmh": st.v * 3.6,
-            "running": self.running,
-            "grade_percent": self.scn.grade_percent,
-            "grade": self.scn.grade_percent,
-            "score": getattr(st, "score", 0),
-            "issues": getattr(st, "issues", {}),
-            "tasc_enabled": getattr(self, "tasc_enabled", False),
-            "tasc_armed": getattr(self, "tasc_armed", False),
-            "tasc_active": getattr(self, "tasc_active", False),
-            "train_name": self.veh.name,
-            "maxSpeed_kmh": self.veh.maxSpeed_kmh,
-
-            # # HUD/디버그용 (업데이트된 Davis 확인 가능)
-            # "mu": float(self.scn.mu),
-            # "rr_factor": float(self.rr_factor),
-            # "davis_A0": self.veh.A0,
-            # "davis_B1": self.veh.B1,
-            # "davis_C2": self.veh.C2,
-
-            # # ▼ 타이머 표시용
-            # "timer_enabled": st.timer_enabled,
-            # "time_budget_s": st.time_budget_s,
-            # "time_remaining_s": st.time_remaining_s,     # float 원본(음수 가능)
-            # "time_remaining_int": st.time_remaining_int, # 정수 표시(내림)
-            # "time_overrun_s": st.time_overrun_s,
-            # "time_overrun_int": st.time_overrun_int,
-            # "time_overrun_started": st.time_overrun_started,
-
-            # # 입력 보정 정보(서버 클램프)
-            # "input_sanitized": getattr(self, "last_input_sanitized", {}),
-        }
+        snap = {}
+        snap["t"] = round(st.t, 3)
+        snap["s"] = st.s
+        snap["v"] = st.v
+        snap["a"] = st.a
+        snap["lever_notch"] = st.lever_notch
+        snap["gear"] = st.gear  # "F" or "R"
+        snap["remaining_m"] = self.scn.L - st.s
+        snap["v_ref"] = self.vref(st.s)
+        snap["finished"] = st.finished
+        snap["stop_error_m"] = st.stop_error_m
+        snap["residual_speed_kmh"] = st.v * 3.6
+        snap["running"] = self.running
+        snap["paused"] = st.paused  # 정지/일시정지 후에는 프레임이 끊기므로 클라이언트가 외삽을 멈추는 근거
+        snap["score"] = st.score
+        snap["issues"] = dict(st.issues)  # 복사본: 브로드캐스트 delta 비교용 (제자리 수정 감지)
+        snap["tasc_enabled"] = self.tasc_enabled
+        snap["tasc_armed"] = self.tasc_armed
+        snap["tasc_active"] = self.tasc_active
+
+        # # HUD/디버그용 (업데이트된 Davis 확인 가능)
+        # "mu": float(self.scn.mu),
+        # "rr_factor": float(self.rr_factor),
+        # "davis_A0": self.veh.A0,
+        # "davis_B1": self.veh.B1,
+        # "davis_C2": self.veh.C2,
+
+        # # ▼ 타이머 표시용
+        # "timer_enabled": st.timer_enabled,
+        # "time_budget_s": st.time_budget_s,
+        # "time_remaining_s": st.time_remaining_s,     # float 원본(음수 가능)
+        # "time_remaining_int": st.time_remaining_int, # 정수 표시(내림)
+        # "time_overrun_s": st.time_overrun_s,
+        # "time_overrun_int": st.time_overrun_int,
+        # "time_overrun_started": st.time_overrun_started,
+
+        # # 입력 보정 정보(서버 클램프)
+        # "input_sanitized": getattr(self, "last_input_sanitized", {}),
+        return snap
 
 
 # ------------------------------------------------------------
@@ -1651,22 +1963,763 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 STATIC_DIR = os.path.join(BASE_DIR, "static")
 
 app = FastAPI()
+# 큰 HTML/JS 응답은 gzip 압축 (작은 응답은 그대로)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# 정적 파일 캐시 정책: URL에 해시가 없으므로 immutable 대신 max-age 후 ETag로 재검증
+STATIC_CACHE_CONTROL = "public, max-age=3600"
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles + Cache-Control. 캐시 유효 기간 동안은 브라우저가 텍스처/오디오를 다시 요청하지 않는다
+    (ETag/Last-Modified 기반 304 응답은 StaticFiles가 처리)"""
+
+    async def get_response(self, path: str, scope):
+        resp = await super().get_response(path, scope)
+        if resp.status_code in (200, 304):
+            resp.headers["Cache-Control"] = STATIC_CACHE_CONTROL
+        return resp
+
 
 # /static 경로 제공
-app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+_static_files = CachedStaticFiles(directory=STATIC_DIR)
+app.mount("/static", _static_files, name="static")
+
+
+async def _cached_file(request: Request, name: str, cache_control: str):
+    # StaticFiles 경로를 재사용해 If-None-Match → 304 처리를 그대로 받는다
+    resp = await _static_files.get_response(name, request.scope)
+    resp.headers["Cache-Control"] = cache_control
+    return resp
+
+INDEX_PATH = os.path.join(STATIC_DIR, "index.html")
+_index_cache: dict = {}  # mtime, raw, gz, etag — index.html 바이트를 메모리에 보관 (파일이 바뀌면 다시 읽음)
+
+
+def _load_index() -> dict:
+    mtime = os.stat(INDEX_PATH).st_mtime
+    if _index_cache.get("mtime") != mtime:
+        with open(INDEX_PATH, "rb") as f:
+            raw = f.read()
+        _index_cache.update(
+            mtime=mtime,
+            raw=raw,
+            gz=gzip.compress(raw, compresslevel=6),  # GZipMiddleware가 요청마다 다시 압축하지 않도록 미리 압축
+            etag='"%s"' % hashlib.md5(raw).hexdigest(),
+        )
+    return _index_cache
+
 #yes
 @app.get("/")
-async def root():
-    return HTMLResponse(open(os.path.join(STATIC_DIR, "index.html"), "r", encoding="utf-8").read())
+async def root(request: Request):
+    # index.html은 배포 시 바로 바뀌어야 하므로 매번 재검증 (변경 없으면 304)
+    idx = _load_index()
+    headers = {"Cache-Control": "no-cache", "ETag": idx["etag"], "Vary": "Accept-Encoding"}
+    if request.headers.get("if-none-match") == idx["etag"]:
+        return Response(status_code=304, headers=headers)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        # Content-Encoding이 이미 있으면 GZipMiddleware는 그대로 통과시킨다
+        headers["Content-Encoding"] = "gzip"
+        return HTMLResponse(idx["gz"], headers=headers)
+    return HTMLResponse(idx["raw"], headers=headers)
 
 @app.get("/favicon.ico")
-async def favicon():
-    return FileResponse(os.path.join(STATIC_DIR, "favicon.ico"))
+async def favicon(request: Request):
+    return await _cached_file(request, "favicon.ico", STATIC_CACHE_CONTROL)
 
 
-@app.websocket("/ws")
-async def ws_endpoint(ws: WebSocket):
-    await ws.accept()
+# ------------------------------------------------------------
+# State broadcast
+# ------------------------------------------------------------
+# 접속마다 send 루프를 두지 않고 단일 태스크가 모든 클라이언트에 스냅샷을 전송한다.
+# 같은 StoppingSim을 보는 클라이언트끼리는 JSON 직렬화를 한 번만 하고, 바이너리 프레임으로 보낸다.
+# 첫 프레임은 전체 상태("state"), 이후로는 직전 전송 대비 바뀐 필드만("delta") 보낸다.
+
+BROADCAST_INTERVAL = 1.0 / 60.0  # 전송 속도: 60Hz (더 부드러운 애니메이션)
+BROADCAST_CHUNK = 50             # 한 번에 gather할 전송 수 (청크 사이에 이벤트 루프 양보)
+
+_clients: dict = {}  # WebSocket -> (StoppingSim, 전송 실패 시 set되는 asyncio.Event)
+_synced: set = set()  # 전체 상태를 이미 받은 WebSocket (이후 delta만 전송)
+_last_snapshots: dict = {}  # id(StoppingSim) -> 직전 틱에 보낸 (정적, 동적) 스냅샷
+_broadcast_task: Optional[asyncio.Task] = None
+
+
+def _diff_snapshot(prev: dict, snap: dict) -> dict:
+    """직전 스냅샷 대비 값이 바뀐(또는 새로 생긴) 필드만 추린다"""
+    return {k: v for k, v in snap.items() if k not in prev or prev[k] != v}
+
+
+def _encode_frame(snap: tuple, prev: Optional[tuple], ts_ns: int) -> Optional[bytes]:
+    """(정적, 동적) 스냅샷 → 전송 프레임. prev가 없으면 전체 "state", 있으면 바뀐 필드만 "delta".
+    바뀐 필드가 없으면 None (타임스탬프만 있는 프레임은 보내지 않음)"""
+    static, dyn = snap
+    if prev is None:
+        return encode_json({"type": "state", "payload": {**static, **dyn, "server_ts_ns": ts_ns}})
+    prev_static, prev_dyn = prev
+    delta = _diff_snapshot(prev_dyn, dyn)
+    # 정적 필드는 템플릿이 다시 만들어졌을 때(reset/구배·차량 변경)만 비교
+    if static is not prev_static:
+        delta.update(_diff_snapshot(prev_static, static))
+    # 정지/일시정지 등으로 바뀐 필드가 없으면 이번 틱은 프레임을 보내지 않음
+    if not delta:
+        return None
+    delta["server_ts_ns"] = ts_ns
+    return encode_json({"type": "delta", "payload": delta})
+
+
+def _unregister_client(ws: WebSocket):
+    _clients.pop(ws, None)
+    _synced.discard(ws)
+
+
+async def _broadcast_loop():
+    global _broadcast_task
+    loop = asyncio.get_running_loop()
+    next_t = loop.time()
+    try:
+        while _clients:
+            snaps = {}  # id(sim) -> (정적 필드 dict, 동적 필드 dict)
+            frames = {}  # (id(sim), 전체 여부) -> 인코딩된 프레임 (바뀐 게 없으면 None)
+            targets = []
+            ts_ns = time.monotonic_ns()  # 보간용 서버 타임스탬프 (단조 시계, 정수 ns): 이번 틱 프레임 공통
+            for ws, (sim, closed) in list(_clients.items()):
+                key = id(sim)
+                snap = snaps.get(key)
+                if snap is None:
+                    snap = snaps[key] = (sim._snap_static, sim.snapshot_dynamic())
+                full = ws not in _synced or key not in _last_snapshots
+                if (key, full) in frames:
+                    frame = frames[(key, full)]
+                else:
+                    frame = frames[(key, full)] = _encode_frame(
+                        snap, None if full else _last_snapshots[key], ts_ns
+                    )
+                if frame is not None:
+                    targets.append((ws, closed, frame))
+                _synced.add(ws)
+            _last_snapshots.clear()
+            _last_snapshots.update(snaps)
+
+            for i in range(0, len(targets), BROADCAST_CHUNK):
+                chunk = targets[i:i + BROADCAST_CHUNK]
+                results = await asyncio.gather(
+                    *(ws.send_bytes(frame) for ws, _, frame in chunk), return_exceptions=True
+                )
+                for (ws, closed, _), r in zip(chunk, results):
+                    if isinstance(r, Exception):
+                        logger.debug("Error during send: %s", r)
+                        _unregister_client(ws)
+                        closed.set()
+                await asyncio.sleep(0)
+
+            # 고정 주기 유지 (밀렸으면 따라잡지 않고 현재 시각부터 다시)
+            next_t += BROADCAST_INTERVAL
+            now = loop.time()
+            if next_t < now:
+                next_t = now
+            await asyncio.sleep(next_t - now)
+    finally:
+        _broadcast_task = None
+        _last_snapshots.clear()
+
+
+def _register_client(ws: WebSocket, sim: "StoppingSim") -> asyncio.Event:
+    global _broadcast_task
+    closed = asyncio.Event()
+    _clients[ws] = (sim, closed)
+    if _broadcast_task is None:
+        _broadcast_task = asyncio.create_task(_broadcast_loop())
+    return closed
+
+
+# ------------------------------------------------------------
+# Command intake
+# ------------------------------------------------------------
+# 수신 전용 태스크가 메시지를 inbox에 쌓고, recv_loop는 깨어날 때마다 쌓인 것을 한 번에 꺼내 처리한다.
+# 슬라이더 조작처럼 setNotch가 연달아 오면 마지막 값만 남긴다 (절대값 명령이라 결과 동일).
+
+if msgspec is not None:
+    class CmdEnvelope(msgspec.Struct):
+        """수신 메시지 외형 {"type": "cmd", "payload": {...}} (payload 내용은 핸들러가 기본값과 함께 읽음)"""
+        type: Literal["cmd"]
+        payload: dict = {}
+
+    # type == "cmd" 검사까지 디코더 안에서 한 번에 처리 (불일치/누락은 ValidationError)
+    _decode_envelope = msgspec.json.Decoder(CmdEnvelope).decode
+
+    def _parse_cmd(msg: str) -> Optional[dict]:
+        """수신 텍스트 → cmd payload (JSON/외형 오류, cmd 아님이면 None)"""
+        try:
+            return _decode_envelope(msg).payload
+        except msgspec.ValidationError:
+            return None
+        except msgspec.DecodeError:
+            logger.debug("Invalid JSON received.")
+            return None
+else:
+    def _parse_cmd(msg: str) -> Optional[dict]:
+        """수신 텍스트 → cmd payload (JSON 오류/cmd 아님이면 None)"""
+        try:
+            data = json.loads(msg)
+        except Exception:
+            logger.debug("Invalid JSON received.")
+            return None
+        if not isinstance(data, dict) or data.get("type") != "cmd":
+            return None
+        payload = data.get("payload", {})
+        return payload if isinstance(payload, dict) else None
+
+
+def _coalesce_commands(payloads: List[dict]) -> List[dict]:
+    """연속된 setNotch는 마지막 것만 유지 (stepNotch 등 상대/이벤트 명령은 그대로)"""
+    out = []
+    for p in payloads:
+        if out and p.get("name") == "setNotch" and out[-1].get("name") == "setNotch":
+            out[-1] = p
+        else:
+            out.append(p)
+    return out
+
+
+@dataclass(slots=True)
+class ClientSession:
+    """sim 하나의 세션 상태 (핸들러 간에 공유되는 편성/탑승률/차량). 같은 session id의 접속들이 함께 쓴다"""
+    sim: StoppingSim
+    vehicle: Vehicle
+    cur_length: int = 10
+    cur_load_rate: float = 0.70
+    n_clients: int = 0  # 이 세션에 붙어 있는 WebSocket 수
+    sim_task: Optional[asyncio.Task] = None  # 세션 공유 sim_loop
+
+
+# 명령별 핸들러: (conn, payload). 수신 루프는 COMMAND_HANDLERS에서 이름으로 바로 찾는다.
+
+def _cmd_set_initial(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    speed = payload.get("speed")
+    dist = payload.get("dist")
+    grade = payload.get("grade", 0.0) / 10.0
+    mu = float(payload.get("mu", 1.0))
+    random_mode = payload.get("random_mode", False)
+    if speed is not None and dist is not None:
+        # ▼ 서버 측 이중 방어(클램프) — 프론트와 동일
+        v_kmh_raw = float(speed)
+        L_raw = float(dist)
+        v_kmh = max(0,  min(300.0, v_kmh_raw))
+        L_m   = max(150.0, min(60000.0,  L_raw))
+
+        sim.scn.v0 = v_kmh / 3.6
+        sim.scn.L = L_m
+        sim.scn.grade_percent = float(grade)
+        sim.scn.mu = mu
+        sim.random_mode = bool(random_mode)
+
+        # 클램프 여부 기록
+        sim.last_input_sanitized = {
+            "speed_input": v_kmh_raw, "speed_used": v_kmh,
+            "dist_input": L_raw, "dist_used": L_m,
+            "clamped": (v_kmh != v_kmh_raw) or (L_m != L_raw)
+        }
+
+        logger.debug("setInitial: v0=%.1fkm/h (%s), L=%.0fm (%s), grade=%s%%, mu=%s, random_mode=%s",
+                     v_kmh, v_kmh_raw, L_m, L_raw, grade, mu, random_mode)
+        sim.reset()  # reset()이 timer_enabled 보존 + budget 재계산
+
+
+def _cmd_advance_station(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    # Advance to the next station. Make this robust by performing
+    # a light reset while preserving world coordinate so visuals
+    # remain continuous.
+    try:
+        # In random mode, allow advance even if not finished yet
+        # In normal mode, only allow after finished
+        is_random_mode = getattr(sim, 'random_mode', False)
+        is_finished = getattr(sim.state, 'finished', False)
+
+        if not is_random_mode and not is_finished:
+            # only meaningful when previous run has finished (in normal mode)
+            logger.debug("[ADVANCE] Game not finished yet, ignoring advanceStation (not in random mode)")
+            return
+
+        if is_random_mode and not is_finished:
+            logger.debug("[ADVANCE] Random mode: allowing advance even though game not finished")
+
+        dist = float(payload.get('dist', 600.0))
+        grade = float(payload.get('grade', 0.0)) / 10.0
+        mu = float(payload.get('mu', sim.scn.mu))
+
+        # clamp sensible ranges (same policy as setInitial)
+        dist = max(150.0, min(60000.0, dist))
+
+        # preserve state across soft-reset
+        prev_s = float(sim.state.s)
+        prev_timer_enabled = getattr(sim.state, 'timer_enabled', False)
+        # Preserve current notch - use the last notch the player set
+        # Priority: use notch_history if available, otherwise final_notch_on_finish, otherwise current lever_notch
+        if sim.notch_history:
+            prev_lever_notch = int(sim.notch_history[-1])
+        elif is_finished and getattr(sim, 'final_notch_on_finish', None) is not None:
+            prev_lever_notch = int(sim.final_notch_on_finish)
+        else:
+            prev_lever_notch = int(sim.state.lever_notch)
+
+        logger.debug("[ADVANCE] Starting soft reset: prev_s=%.2f, timer_enabled=%s, "
+                     "notch=%s (from notch_history=%s entries), is_finished=%s",
+                     prev_s, prev_timer_enabled, prev_lever_notch, len(sim.notch_history), is_finished)
+
+        # perform a reset to clear command queue / timing artifacts,
+        # then restore the world coordinate and apply new scenario end
+        sim.reset()
+
+        # restore preserved flags/position/notch
+        sim.state.s = prev_s
+        sim.state.timer_enabled = prev_timer_enabled
+        sim.state.lever_notch = prev_lever_notch
+
+        # set new absolute L so that remaining == dist
+        sim.scn.L = float(prev_s) + dist
+        sim.scn.grade_percent = float(grade)
+        sim.scn.mu = float(mu)
+        sim._refresh_physics_cache()
+
+        # recompute timer budget according to new scenario
+        try:
+            tb = sim._compute_time_budget()
+        except Exception:
+            tb = getattr(sim.state, 'time_budget_s', 0.0)
+
+        sim.state.time_budget_s = float(tb)
+        sim.state.time_remaining_s = float(tb)
+        sim.state.time_remaining_int = int(sim.state.time_remaining_s)
+
+        # enable timer if a positive budget was computed
+        if sim.state.time_budget_s > 0.0:
+            sim.state.timer_enabled = True
+
+        # refresh vref in case L changed
+        try:
+            sim.vref = build_vref(sim.scn.L, 0.8 * sim.veh.a_max)
+        except Exception:
+            pass
+
+        # start from rest and clear finished/run_over
+        sim.state.finished = False
+        sim.state.stop_error_m = None
+        sim.state.residual_speed_kmh = 0.0
+        sim.state.v = 0.0
+        sim.state.a = 0.0
+        # NOTE: Do NOT reset lever_notch here - keep the preserved notch from previous run
+        # sim.state.lever_notch = 0
+
+        # CRITICAL: Set running=True to ensure physics loop continues
+        sim.running = True
+        sim.run_over = False
+
+        # Ensure acceleration filter is reset to allow clean start
+        sim._a_cmd_filt = 0.0
+
+        logger.debug("[ADVANCE] Completed: s=%.2fm, L=%.0fm (remaining=%.0fm), grade=%s%%, mu=%.2f, "
+                     "timer=%.1fs",
+                     prev_s, sim.scn.L, dist, sim.scn.grade_percent, sim.scn.mu, sim.state.time_budget_s)
+        logger.debug("[ADVANCE] *** CRITICAL CHECK ***")
+        logger.debug("[ADVANCE] >>> sim.running=%s (should be True)", sim.running)
+        logger.debug("[ADVANCE] >>> sim.state.v=%s (should be 0.0)", sim.state.v)
+        logger.debug("[ADVANCE] >>> sim.state.finished=%s (should be False)", sim.state.finished)
+        logger.debug("[ADVANCE] >>> sim.state.lever_notch=%s (should be %s, preserved from previous run)", sim.state.lever_notch, prev_lever_notch)
+        logger.debug("[ADVANCE] >>> sim._a_cmd_filt=%s (will be initialized when notch applied)", sim._a_cmd_filt)
+    except Exception as e:
+        logger.debug("[ADVANCE] ERROR: %s", e)
+        import traceback
+        traceback.print_exc()
+
+
+def _cmd_start(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    sim.start()
+    sim.run_over = False
+
+
+def _cmd_step_notch(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    delta = payload.get("delta", 0)
+    sim.queue_command("stepNotch", delta)
+    # Update final_notch_on_finish if simulation is finished (for random mode)
+    # Process pending commands first to get actual notch value
+    if sim.state.finished:
+        sim.final_notch_on_finish = sim.drain_applicable_commands()
+        logger.debug("[FINISHED NOTCH] Updated to %s (stepNotch delta=%s)", sim.final_notch_on_finish, delta)
+
+
+def _cmd_release(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    sim.queue_command("release", 0)
+    # Update final_notch_on_finish if simulation is finished
+    if sim.state.finished:
+        sim.drain_applicable_commands()
+        sim.final_notch_on_finish = 0
+        logger.debug("[FINISHED NOTCH] Updated to 0 (release)")
+
+
+def _cmd_emergency_brake(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    sim.queue_command("emergencyBrake", 0)
+    # Update final_notch_on_finish if simulation is finished
+    if sim.state.finished:
+        sim.final_notch_on_finish = sim.drain_applicable_commands()
+        logger.debug("[FINISHED NOTCH] Updated to %s (EB)", sim.state.lever_notch)
+
+
+def _cmd_set_notch(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    # 'val'이나 'delta'에 상관없이 value가 있다면 우선
+    val = payload.get("val", payload.get("delta", payload.get("value", 0)))
+    sim.queue_command("setNotch", val)
+    # Update final_notch_on_finish if simulation is finished
+    if sim.state.finished:
+        sim.final_notch_on_finish = sim.drain_applicable_commands()
+        logger.debug("[FINISHED NOTCH] Updated to %s (setNotch val=%s)", sim.state.lever_notch, val)
+
+
+def _cmd_set_internal_notch(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    val = payload.get("val", payload.get("delta", payload.get("value", 0)))
+    sim.queue_command("setInternalNotch", val)
+
+
+def _cmd_atc_overspeed(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    val = payload.get("val", payload.get("delta", payload.get("value", 0)))
+    sim.queue_command("atcOverspeed", val)
+
+
+def _cmd_set_grade(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    # Random grade update from client
+    grade = float(payload.get("grade", 0.0))
+    sim.scn.grade_percent = grade
+    sim._refresh_physics_cache()
+    logger.debug("[RANDOM GRADE] Updated to %s%% (‰: %.1f)", grade, grade * 10)
+
+
+def _cmd_toggle_gear(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    # 기어 변경 규칙:
+    # - 속도 0 && 브레이크 1단 이상: F ↔ N ↔ R 자유롭게 순환
+    # - 그 외: F ↔ N, R ↔ N (N에서는 이전 이동방향으로 복귀)
+    st = sim.state
+    can_full_toggle = (abs(st.v) < 0.01) and (st.lever_notch >= 1)
+
+    if can_full_toggle:
+        # 자유롭게 순환: F → N → R → F → ...
+        if st.gear == "F":
+            st.gear = "N"
+        elif st.gear == "N":
+            st.gear = "R"
+        elif st.gear == "R":
+            st.gear = "F"
+        logger.debug("[GEAR] Changed to %s (full toggle)", st.gear)
+    else:
+        # 제한된 전환: F ↔ N, R ↔ N
+        if st.gear == "F":
+            st.gear = "N"
+            logger.debug("[GEAR] F → N")
+        elif st.gear == "R":
+            st.gear = "N"
+            logger.debug("[GEAR] R → N")
+        elif st.gear == "N":
+            # N에서는 이동 방향에 따라 복귀
+            if st.move_direction == -1:
+                st.gear = "R"
+                logger.debug("[GEAR] N → R (move_direction=-1)")
+            else:
+                st.gear = "F"
+                logger.debug("[GEAR] N → F (move_direction=1)")
+
+
+def _cmd_set_train_length(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    length = int(payload.get("length", 8))
+    conn.cur_length = length #  상태 저장
+
+    # 길이 반영
+    sim.veh.update_mass(conn.cur_length)
+
+    # 탑승률이 이미 있다면 총중량 덮어쓰기 + 재계산
+    base_1c_t = sim.veh.mass_t
+    pax_1c_t = 10.5
+    total_tons = conn.cur_length * (base_1c_t + pax_1c_t * conn.cur_load_rate)
+    sim.veh.mass_kg = total_tons * 1000.0
+    sim.veh.recompute_davis(sim.veh.mass_kg)
+    sim.veh.calibrate_C2_from_power(300.0, eta=0.85)
+
+    logger.debug("[Length] %s cars | load=%.1f%% -> mass_kg=%.0f, A0=%.1f, B1=%.2f, C2=%.2f",
+                 conn.cur_length, conn.cur_load_rate*100, sim.veh.mass_kg, sim.veh.A0, sim.veh.B1, sim.veh.C2)
+    sim.request_reset()
+
+
+def _cmd_set_mass_tons(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    mass_tons = float(payload.get("mass_tons", 200.0))
+    sim.veh.mass_t = mass_tons / int(payload.get("length", 8))
+    sim.veh.mass_kg = mass_tons * 1000.0
+    sim.veh.recompute_davis(sim.veh.mass_kg) #  새 질량으로 재계산
+    sim.veh.calibrate_C2_from_power(300.0, eta=0.85)
+    logger.debug("총중량=%.2f t -> A0=%.1f, B1=%.2f, C2=%.2f", mass_tons, sim.veh.A0, sim.veh.B1, sim.veh.C2)
+    sim.request_reset()
+
+
+def _cmd_set_load_rate(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    conn.cur_load_rate = float(payload.get("loadRate", 0.0)) / 100.0 #  상태 저장
+
+    # 길이/탑승률로 총중량 재산출
+    base_1c_t = sim.veh.mass_t
+    pax_1c_t = 10.5
+    total_tons = conn.cur_length * (base_1c_t + pax_1c_t * conn.cur_load_rate)
+
+    sim.veh.update_mass(conn.cur_length) # 1차 (길이 반영)
+    sim.veh.mass_kg = total_tons * 1000.0 # 실제 총중량 덮어쓰기
+    sim.veh.recompute_davis(sim.veh.mass_kg) # 최종 재계산
+    sim.veh.calibrate_C2_from_power(300.0, eta=0.85)
+
+    logger.debug("[LoadRate] length=%s, load=%.1f%% -> mass_kg=%.0f, A0=%.1f, B1=%.2f, C2=%.2f",
+                 conn.cur_length, conn.cur_load_rate*100, sim.veh.mass_kg, sim.veh.A0, sim.veh.B1, sim.veh.C2)
+    sim.request_reset()
+
+
+def _cmd_set_tasc(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    enabled = bool(payload.get("enabled", False))
+    sim.tasc_enabled = enabled
+    sim.tasc_enabled_initially = enabled  # random mode 복구용 저장
+    if enabled:
+        sim.manual_override = False
+        sim._tasc_last_change_t = sim.state.t
+        sim._tasc_phase = "build"
+        sim._tasc_peak_notch = 1
+        sim.tasc_armed = True
+        sim.tasc_active = False
+        sim._clear_tasc_pred_cache()
+    logger.debug("TASC set to %s", enabled)
+
+
+def _cmd_obstacle_stop_success(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    sim.eb_used = False
+    sim.first_brake_done = True
+
+
+def _cmd_obstacle_stop_fail(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    sim.run_over = True
+
+
+def _cmd_set_mu(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    value = float(payload.get("value", 1.0))
+    sim.scn.mu = value
+    logger.debug("마찰계수(mu)=%s", value)
+    sim.request_reset()
+
+
+def _cmd_set_vehicle_file(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    rel = payload.get("file", "")
+    if rel:
+        try:
+            # 경로 정규화
+            rel_norm = rel.strip()
+            if rel_norm.startswith("/static/emu_db/"): rel_norm = rel_norm[len("/static/emu_db/"):]
+            elif rel_norm.startswith("static/emu_db/"): rel_norm = rel_norm[len("static/emu_db/"):]
+            path = os.path.join(STATIC_DIR + "/emu_db", rel_norm)
+
+            if not os.path.isfile(path):
+                raise FileNotFoundError(path)
+
+            newv = Vehicle.from_json(path)
+            newv.notch_accels = list(reversed(newv.notch_accels))
+            newv.notches = len(newv.notch_accels)
+            newv.recompute_davis(newv.mass_kg)
+
+            sim.veh = newv
+            conn.vehicle = newv
+
+            # 🔒 차량 교체 직후, 현재 길이/탑승률 재적용 (순서 무관 일관성 보장)
+            sim.veh.update_mass(conn.cur_length)
+            base_1c_t = sim.veh.mass_t
+            pax_1c_t = 10.5
+            total_tons = conn.cur_length * (base_1c_t + pax_1c_t * conn.cur_load_rate)
+            sim.veh.mass_kg = total_tons * 1000.0
+            sim.veh.recompute_davis(sim.veh.mass_kg)
+            sim.veh.calibrate_C2_from_power(300.0, eta=0.85)
+
+            sim.request_reset()
+
+            logger.debug("[Vehicle] switched -> %s (%s) | len=%s, load=%.1f%% "
+                         "| mass_kg=%.0f A0=%.1f B1=%.2f C2=%.2f",
+                         rel, path, conn.cur_length, conn.cur_load_rate*100, sim.veh.mass_kg, sim.veh.A0, sim.veh.B1, sim.veh.C2)
+        except Exception as e:
+            logger.debug("[Vehicle] load failed: %s -> %s", rel, e)
+
+
+def _cmd_reset(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    sim.reset()
+
+
+# ---------- 타이머/페널티/보너스/보정 설정 ----------
+def _cmd_set_timer_formula(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    # payload: { "enabled": true, "v_target_kmh": 70, "buffer_s": 0 }
+    sim.timer_use_table = False
+    sim.state.timer_enabled = bool(payload.get("enabled", True))
+    sim.timer_v_target_kmh = float(payload.get("v_target_kmh", 70))
+    sim.timer_buffer_s = float(payload.get("buffer_s", 0.0))
+    sim.request_reset()
+
+
+def _cmd_set_timer_table(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    # payload: { "enabled": true, "table": { "60":35, "70":30, "80":26 } }
+    tbl = payload.get("table", {})
+    sim.timer_use_table = True
+    sim.state.timer_enabled = bool(payload.get("enabled", True))
+    sim.timer_table = {int(k): float(v) for k, v in tbl.items()}
+    sim.request_reset()
+
+
+def _cmd_toggle_timer(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    # payload: { "enabled": false }
+    sim.state.timer_enabled = bool(payload.get("enabled", False))
+    sim.request_reset()
+
+
+def _cmd_set_timer_penalty(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    # payload: { "per_s": 20, "cap": 400 }
+    sim.timer_overtime_penalty_per_s = float(payload.get("per_s", 20.0))
+    sim.timer_overtime_penalty_cap = float(payload.get("cap", 400.0))
+
+
+def _cmd_set_timer_exact_bonus(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    # payload: {"bonus": 100}
+    sim.timer_exact_bonus = float(payload.get("bonus", 100))
+
+
+def _cmd_set_timer_calib(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    # payload 예시:
+    # {
+    #   "points":[
+    #     {"v":60, "L":200, "t":23},
+    #     {"v":70, "L":200, "t":28},
+    #     {"v":90, "L":400, "t":30}
+    #   ],
+    #   "norm_v": 100, "norm_L": 300,
+    #   "idw_power": 2.0, "blend_threshold": 1.5
+    # }
+    pts = payload.get("points", [])
+    sim.set_timer_calibration(
+        points=pts,
+        norm_v=payload.get("norm_v"),
+        norm_L=payload.get("norm_L"),
+        idw_power=payload.get("idw_power"),
+        blend_threshold=payload.get("blend_threshold"),
+    )
+    # 자동 산출이 적용되도록 리셋
+    sim.state.timer_enabled = True
+    sim.request_reset()
+
+
+def _cmd_pause(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    # 🎮 게임 일시정지
+    sim.state.paused = True
+    logger.debug("[PAUSE] Game paused at t=%.2fs, v=%.1fkm/h", sim.state.t, sim.state.v*3.6)
+
+
+def _cmd_resume(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    # 🎮 게임 재개
+    sim.state.paused = False
+    sim.wake()
+    logger.debug("[RESUME] Game resumed from t=%.2fs, v=%.1fkm/h", sim.state.t, sim.state.v*3.6)
+
+
+def _cmd_default(conn: "ClientSession", payload: dict):
+    sim = conn.sim
+    name = payload.get("name")
+    # 전용 핸들러가 없는 명령은 tau_cmd 지연 명령으로 큐에 넣는다
+    cmd_val = payload.get("val", payload.get("delta", 0))
+    sim.queue_command(name, cmd_val)
+
+
+COMMAND_HANDLERS = {
+    "setInitial": _cmd_set_initial,
+    "advanceStation": _cmd_advance_station,
+    "start": _cmd_start,
+    "stepNotch": _cmd_step_notch,
+    "applyNotch": _cmd_step_notch,
+    "release": _cmd_release,
+    "emergencyBrake": _cmd_emergency_brake,
+    "setNotch": _cmd_set_notch,
+    "setInternalNotch": _cmd_set_internal_notch,
+    "atcOverspeed": _cmd_atc_overspeed,
+    "setGrade": _cmd_set_grade,
+    "toggleGear": _cmd_toggle_gear,
+    "setTrainLength": _cmd_set_train_length,
+    "setMassTons": _cmd_set_mass_tons,
+    "setLoadRate": _cmd_set_load_rate,
+    "setTASC": _cmd_set_tasc,
+    "obstacleStopSuccess": _cmd_obstacle_stop_success,
+    "obstacleStopFail": _cmd_obstacle_stop_fail,
+    "setMu": _cmd_set_mu,
+    "setVehicleFile": _cmd_set_vehicle_file,
+    "reset": _cmd_reset,
+    "setTimerFormula": _cmd_set_timer_formula,
+    "setTimerTable": _cmd_set_timer_table,
+    "toggleTimer": _cmd_toggle_timer,
+    "setTimerPenalty": _cmd_set_timer_penalty,
+    "setTimerExactBonus": _cmd_set_timer_exact_bonus,
+    "setTimerCalib": _cmd_set_timer_calib,
+    "pause": _cmd_pause,
+    "resume": _cmd_resume,
+}
+
+# reset()을 예약만 하는 설정 명령: 연속으로 오면 리셋은 묶음 끝에서 한 번만 수행된다.
+# 그 밖의 명령은 처리 전에 예약된 리셋을 먼저 반영해 기존 실행 순서를 그대로 유지한다.
+DEFERRED_RESET_COMMANDS = frozenset({
+    "setTrainLength", "setMassTons", "setLoadRate", "setMu", "setVehicleFile",
+    "setTimerFormula", "setTimerTable", "toggleTimer", "setTimerCalib",
+})
+
+
+def _dispatch_commands(conn: ClientSession, payloads: List[dict]):
+    """수신 묶음 하나를 순서대로 처리 (setNotch 합치기 + 설정 명령 리셋은 묶음당 한 번).
+    이벤트 루프 양보 없이 끝나므로 sim_loop/브로드캐스트가 리셋 전 상태를 보는 일은 없다"""
+    sim = conn.sim
+    for payload in _coalesce_commands(payloads):
+        name = payload.get("name")
+        if name not in DEFERRED_RESET_COMMANDS:
+            sim.flush_pending_reset()
+        COMMAND_HANDLERS.get(name, _cmd_default)(conn, payload)
+    sim.flush_pending_reset()
+
+
+# ------------------------------------------------------------
+# Sessions
+# ------------------------------------------------------------
+# 같은 session id(/ws?session=...)로 접속한 클라이언트는 StoppingSim과 sim_loop를 하나씩만 공유한다
+# (새로고침/관전자가 늘어도 물리 루프는 하나). id 없이 접속하면 기존처럼 접속마다 독립된 sim.
+# asyncio 단일 스레드에서만 접근하므로 잠금은 필요 없다.
+SIM_REGISTRY: dict = {}  # session id -> ClientSession
+
+
+def _new_session() -> ClientSession:
+    """기본 차량/시나리오로 sim을 만들고 기본 편성/탑승률까지 반영한 세션"""
     cur_length = 10
     cur_load_rate = 0.70
     vehicle_json_path = os.path.join(STATIC_DIR, "emu_db/e233_1000.json")
@@ -1692,576 +2745,182 @@ async def ws_endpoint(ws: WebSocket):
     sim.veh.recompute_davis(sim.veh.mass_kg)
     sim.veh.calibrate_C2_from_power(300.0, eta=0.85)
 
-    if DEBUG:
-        print(f"[INIT] len={cur_length}, load={cur_load_rate*100:.1f}% "
-              f"-> base_1c_t={base_1c_t:.3f} t, pax_1c_t={pax_1c_t:.2f} t "
-              f"| total={total_tons:.2f} t, mass_kg={sim.veh.mass_kg:.0f} "
-              f"| A0={sim.veh.A0:.1f}, B1={sim.veh.B1:.2f}, C2={sim.veh.C2:.2f}")
+    logger.debug("[INIT] len=%s, load=%.1f%% -> base_1c_t=%.3f t, pax_1c_t=%.2f t | total=%.2f t, "
+                 "mass_kg=%.0f | A0=%.1f, B1=%.2f, C2=%.2f",
+                 cur_length, cur_load_rate*100, base_1c_t, pax_1c_t, total_tons, sim.veh.mass_kg, sim.veh.A0, sim.veh.B1, sim.veh.C2)
 
     sim.reset() #  재계산 반영된 상태로 다시 초기화(처음부터 일관)
     sim.running = False
+    return ClientSession(sim, vehicle, cur_length, cur_load_rate)
+
+
+async def _sim_loop(sim: StoppingSim):
+    """sim 하나의 물리 루프 (세션당 하나, 접속 수와 무관)"""
+    # 고정 시간 간격(fix-your-timestep) 누적기: 실제 경과 시간을 모아 dt 단위로 소비
+    dt = sim.scn.dt
+    max_backlog_s = 0.25  # 한 번에 따라잡을 최대 시간 (GC/OS 지연 시 초과분은 버림)
+    max_steps_per_wake = 50  # 한 번 깨어날 때 실행할 최대 스텝 수 (그 이상은 양보 후 이어서)
+    accum = 0.0
+    t_prev = None  # 시작 시점은 start() 눌렀을 때 설정
+    was_running = False
+    was_finished = False
+    was_paused = False
+    loop_iterations = 0
+
+    while True:
+        loop_iterations += 1
+        backlog = False
+
+        # Detect if finished state just changed (soft-reset/advanceStation happened)
+        is_finished_now = getattr(sim.state, 'finished', False)
+        if is_finished_now != was_finished:
+            logger.debug("[SIM_LOOP] Finished state changed: %s → %s", was_finished, is_finished_now)
+            if not is_finished_now and was_finished and sim.running:
+                # Just transitioned from finished→not-finished while running
+                # This means advanceStation reset the state, so reset timing!
+                logger.debug("[SIM_LOOP] *** DETECTED SOFT-RESET: Resetting timing (iteration %s)", loop_iterations)
+                t_prev = time.perf_counter()
+                accum = 0.0
+            was_finished = is_finished_now
+
+        # 🎮 게임 일시정지 상태 확인
+        is_paused_now = getattr(sim.state, 'paused', False)
+        if is_paused_now and not was_paused:
+            logger.debug("[SIM_LOOP] Game paused (iteration %s)", loop_iterations)
+        elif not is_paused_now and was_paused:
+            logger.debug("[SIM_LOOP] Game resumed (iteration %s)", loop_iterations)
+            # 일시정지에서 복귀하면 시간 기준점을 갱신
+            t_prev = time.perf_counter()
+            accum = 0.0
+        was_paused = is_paused_now
+
+        if sim.running and not is_paused_now:  # 게임 실행 중이고 일시정지 아님
+            if not was_running:
+                logger.debug("[SIM_LOOP] Transitioned to running state (iteration %s)", loop_iterations)
+                t_prev = time.perf_counter()
+                accum = 0.0
+
+            t_now = time.perf_counter()
+            accum += t_now - t_prev
+            t_prev = t_now
+            if accum > max_backlog_s:
+                accum = max_backlog_s
+
+            # 누적된 시간만큼 고정 dt 스텝 진행 (한 번의 호출로 묶어서 실행)
+            n = min(int(accum / dt), max_steps_per_wake)
+            if n > 0:
+                if loop_iterations % 100 == 0:
+                    logger.debug("[SIM_LOOP] Executing %s steps (iteration %s, backlog %.4fs)", n, loop_iterations, accum)
+                sim.step_many(n)
+                accum -= n * dt
+                # 상한에 걸려 남은 스텝이 있으면 다른 태스크(전송/수신)에 한 번 양보하고 바로 이어서 진행
+                backlog = accum >= dt
+            was_running = True
+
+        else:
+        # ★ 정지 상태에서는 기준값들을 항상 초기화
+            if was_running:
+                logger.debug("[SIM_LOOP] Transitioned to stopped state (iteration %s)", loop_iterations)
+            was_running = False
+            t_prev = None
+            accum = 0.0
+            # 정지/일시정지 중에는 dt마다 깨어나지 않고 start/resume 등이 wake()할 때까지 대기
+            # (clear와 wait 사이에 await가 없으므로 깨우기 신호를 놓치지 않음)
+            sim._run_event.clear()
+            await sim._run_event.wait()
+            continue
+
+        await asyncio.sleep(0 if backlog else dt)  # dt 기반 sleep (CPU 효율성)
+
+
+def _acquire_session(session_id: Optional[str]) -> ClientSession:
+    """session id의 세션에 합류 (없으면 새로 만들고 sim_loop 시작)"""
+    conn = SIM_REGISTRY.get(session_id) if session_id else None
+    if conn is None:
+        conn = _new_session()
+        conn.sim_task = asyncio.create_task(_sim_loop(conn.sim))
+        if session_id:
+            SIM_REGISTRY[session_id] = conn
+    conn.n_clients += 1
+    return conn
+
+
+def _release_session(session_id: Optional[str], conn: ClientSession):
+    """접속 하나가 빠짐. 마지막 접속이면 sim_loop를 멈추고 세션을 지운다"""
+    conn.n_clients -= 1
+    if conn.n_clients > 0:
+        return
+    conn.sim_task.cancel()
+    if session_id and SIM_REGISTRY.get(session_id) is conn:
+        del SIM_REGISTRY[session_id]
 
 
-    # 전송 속도: 60Hz (더 부드러운 애니메이션)
-    send_interval = 1.0 / 60.0
+@app.websocket("/ws")
+async def ws_endpoint(ws: WebSocket):
+    await ws.accept()
+    session_id = ws.query_params.get("session") or None
+    conn = _acquire_session(session_id)
+    sim = conn.sim
 
     # ---- 분리된 비동기 루프들 ----
-    async def recv_loop():
-        # vehicle(바깥 스코프 변수)에 재할당 가능하게
-        nonlocal vehicle, cur_length, cur_load_rate
+    inbox: asyncio.Queue = asyncio.Queue()
+
+    async def reader():
+        # 소켓 수신만 담당 (끊기면 태스크 종료 → ws_endpoint 정리)
         try:
             while True:
-                msg = await ws.receive_text()
-                try:
-                    data = json.loads(msg)
-                except Exception:
-                    if DEBUG:
-                        print("Invalid JSON received.")
-                    continue
-
-                if data.get("type") != "cmd":
-                    continue
-
-                payload = data.get("payload", {})
-                name = payload.get("name")
-
-                if name == "setInitial":
-                    speed = payload.get("speed")
-                    dist = payload.get("dist")
-                    grade = payload.get("grade", 0.0) / 10.0
-                    mu = float(payload.get("mu", 1.0))
-                    random_mode = payload.get("random_mode", False)
-                    if speed is not None and dist is not None:
-                        # ▼ 서버 측 이중 방어(클램프) — 프론트와 동일
-                        v_kmh_raw = float(speed)
-                        L_raw = float(dist)
-                        v_kmh = max(0,  min(300.0, v_kmh_raw))
-                        L_m   = max(150.0, min(60000.0,  L_raw))
-
-                        sim.scn.v0 = v_kmh / 3.6
-                        sim.scn.L = L_m
-                        sim.scn.grade_percent = float(grade)
-                        sim.scn.mu = mu
-                        sim.random_mode = bool(random_mode)
-
-                        # 클램프 여부 기록
-                        sim.last_input_sanitized = {
-                            "speed_input": v_kmh_raw, "speed_used": v_kmh,
-                            "dist_input": L_raw, "dist_used": L_m,
-                            "clamped": (v_kmh != v_kmh_raw) or (L_m != L_raw)
-                        }
-
-                        if DEBUG:
-                            print(f"setInitial: v0={v_kmh:.1f}km/h ({v_kmh_raw}), "
-                                  f"L={L_m:.0f}m ({L_raw}), grade={grade}%, mu={mu}, random_mode={random_mode}")
-                        sim.reset()  # reset()이 timer_enabled 보존 + budget 재계산
-
-                elif name == "advanceStation":
-                    # Advance to the next station. Make this robust by performing
-                    # a light reset while preserving world coordinate so visuals
-                    # remain continuous.
-                    try:
-                        # In random mode, allow advance even if not finished yet
-                        # In normal mode, only allow after finished
-                        is_random_mode = getattr(sim, 'random_mode', False)
-                        is_finished = getattr(sim.state, 'finished', False)
-                        
-                        if not is_random_mode and not is_finished:
-                            # only meaningful when previous run has finished (in normal mode)
-                            if DEBUG:
-                                print(f"[ADVANCE] Game not finished yet, ignoring advanceStation (not in random mode)")
-                            continue
-                        
-                        if is_random_mode and not is_finished and DEBUG:
-                            print(f"[ADVANCE] Random mode: allowing advance even though game not finished")
-
-                        dist = float(payload.get('dist', 600.0))
-                        grade = float(payload.get('grade', 0.0)) / 10.0
-                        mu = float(payload.get('mu', sim.scn.mu))
-
-                        # clamp sensible ranges (same policy as setInitial)
-                        dist = max(150.0, min(60000.0, dist))
-
-                        # preserve state across soft-reset
-                        prev_s = float(sim.state.s)
-                        prev_timer_enabled = getattr(sim.state, 'timer_enabled', False)
-                        # Preserve current notch - use the last notch the player set
-                        # Priority: use notch_history if available, otherwise final_notch_on_finish, otherwise current lever_notch
-                        if sim.notch_history:
-                            prev_lever_notch = int(sim.notch_history[-1])
-                        elif is_finished and getattr(sim, 'final_notch_on_finish', None) is not None:
-                            prev_lever_notch = int(sim.final_notch_on_finish)
-                        else:
-                            prev_lever_notch = int(sim.state.lever_notch)
-
-                        if DEBUG:
-                            print(f"[ADVANCE] Starting soft reset: prev_s={prev_s:.2f}, timer_enabled={prev_timer_enabled}, notch={prev_lever_notch} (from notch_history={len(sim.notch_history)} entries), is_finished={is_finished}")
-
-                        # perform a reset to clear command queue / timing artifacts,
-                        # then restore the world coordinate and apply new scenario end
-                        sim.reset()
-
-                        # restore preserved flags/position/notch
-                        sim.state.s = prev_s
-                        sim.state.timer_enabled = prev_timer_enabled
-                        sim.state.lever_notch = prev_lever_notch
-
-                        # set new absolute L so that remaining == dist
-                        sim.scn.L = float(prev_s) + dist
-                        sim.scn.grade_percent = float(grade)
-                        sim.scn.mu = float(mu)
-
-                        # recompute timer budget according to new scenario
-                        try:
-                            tb = sim._compute_time_budget()
-                        except Exception:
-                            tb = getattr(sim.state, 'time_budget_s', 0.0)
-
-                        sim.state.time_budget_s = float(tb)
-                        sim.state.time_remaining_s = float(tb)
-                        sim.state.time_remaining_int = math.floor(sim.state.time_remaining_s)
-
-                        # enable timer if a positive budget was computed
-                        if sim.state.time_budget_s > 0.0:
-                            sim.state.timer_enabled = True
-
-                        # refresh vref in case L changed
-                        try:
-                            sim.vref = build_vref(sim.scn.L, 0.8 * sim.veh.a_max)
-                        except Exception:
-                            pass
-
-                        # start from rest and clear finished/run_over
-                        sim.state.finished = False
-                        sim.state.stop_error_m = None
-                        sim.state.residual_speed_kmh = 0.0
-                        sim.state.v = 0.0
-                        sim.state.a = 0.0
-                        # NOTE: Do NOT reset lever_notch here - keep the preserved notch from previous run
-                        # sim.state.lever_notch = 0
-
-                        # CRITICAL: Set running=True to ensure physics loop continues
-                        sim.running = True
-                        sim.run_over = False
-                        
-                        # Ensure acceleration filter is reset to allow clean start
-                        sim._a_cmd_filt = 0.0
-
-                        if DEBUG:
-                            print(f"[ADVANCE] Completed: s={prev_s:.2f}m, L={sim.scn.L:.0f}m (remaining={dist:.0f}m), grade={sim.scn.grade_percent}%, mu={sim.scn.mu:.2f}, timer={sim.state.time_budget_s:.1f}s")
-                            print(f"[ADVANCE] *** CRITICAL CHECK ***")
-                            print(f"[ADVANCE] >>> sim.running={sim.running} (should be True)")
-                            print(f"[ADVANCE] >>> sim.state.v={sim.state.v} (should be 0.0)")
-                            print(f"[ADVANCE] >>> sim.state.finished={sim.state.finished} (should be False)")
-                            print(f"[ADVANCE] >>> sim.state.lever_notch={sim.state.lever_notch} (should be {prev_lever_notch}, preserved from previous run)")
-                            print(f"[ADVANCE] >>> sim._a_cmd_filt={sim._a_cmd_filt} (will be initialized when notch applied)")
-                    except Exception as e:
-                        if DEBUG:
-                            print(f"[ADVANCE] ERROR: {e}")
-                        import traceback
-                        traceback.print_exc()
-
-                elif name == "start":
-                    sim.start()
-                    sim.run_over = False
-
-                elif name in ("stepNotch", "applyNotch"):
-                    delta = int(payload.get("delta", 0))
-                    sim.queue_command("stepNotch", delta)
-                    # Update final_notch_on_finish if simulation is finished (for random mode)
-                    # Process pending commands first to get actual notch value
-                    if sim.state.finished:
-                        while sim._cmd_queue and sim._cmd_queue[0]["t"] <= sim.state.t:
-                            cmd = sim._cmd_queue.popleft()
-                            sim._apply_command(cmd)
-                        sim.final_notch_on_finish = sim.state.lever_notch
-                        if DEBUG:
-                            print(f"[FINISHED NOTCH] Updated to {sim.final_notch_on_finish} (stepNotch delta={delta})")
-
-                elif name == "release":
-                    sim.queue_command("release", 0)
-                    # Update final_notch_on_finish if simulation is finished
-                    if sim.state.finished:
-                        while sim._cmd_queue and sim._cmd_queue[0]["t"] <= sim.state.t:
-                            cmd = sim._cmd_queue.popleft()
-                            sim._apply_command(cmd)
-                        sim.final_notch_on_finish = 0
-                        if DEBUG:
-                            print(f"[FINISHED NOTCH] Updated to 0 (release)")
-
-                elif name == "emergencyBrake":
-                    sim.queue_command("emergencyBrake", 0)
-                    # Update final_notch_on_finish if simulation is finished
-                    if sim.state.finished:
-                        while sim._cmd_queue and sim._cmd_queue[0]["t"] <= sim.state.t:
-                            cmd = sim._cmd_queue.popleft()
-                            sim._apply_command(cmd)
-                        sim.final_notch_on_finish = sim.state.lever_notch
-                        if DEBUG:
-                            print(f"[FINISHED NOTCH] Updated to {sim.state.lever_notch} (EB)")
-
-                elif name == "setNotch":
-    # 'val'이나 'delta'에 상관없이 value가 있다면 우선
-                    val = payload.get("val", payload.get("delta", payload.get("value", 0)))
-                    sim.queue_command("setNotch", val)
-                    # Update final_notch_on_finish if simulation is finished
-                    if sim.state.finished:
-                        while sim._cmd_queue and sim._cmd_queue[0]["t"] <= sim.state.t:
-                            cmd = sim._cmd_queue.popleft()
-                            sim._apply_command(cmd)
-                        sim.final_notch_on_finish = sim.state.lever_notch
-                        if DEBUG:
-                            print(f"[FINISHED NOTCH] Updated to {sim.state.lever_notch} (setNotch val={val})")
-                elif name == "setInternalNotch":
-                    val = payload.get("val", payload.get("delta", payload.get("value", 0)))
-                    sim.queue_command("setInternalNotch", val)
-                elif name == "atcOverspeed":
-                    val = payload.get("val", payload.get("delta", payload.get("value", 0)))
-                    sim.queue_command("atcOverspeed", val)
-                elif name == "setGrade":
-                    # Random grade update from client
-                    grade = float(payload.get("grade", 0.0))
-                    sim.scn.grade_percent = grade
-                    if DEBUG:
-                        print(f"[RANDOM GRADE] Updated to {grade}% (‰: {grade * 10:.1f})")
-
-                elif name == "toggleGear":
-                    # 기어 변경 규칙:
-                    # - 속도 0 && 브레이크 1단 이상: F ↔ N ↔ R 자유롭게 순환
-                    # - 그 외: F ↔ N, R ↔ N (N에서는 이전 이동방향으로 복귀)
-                    st = sim.state
-                    can_full_toggle = (abs(st.v) < 0.01) and (st.lever_notch >= 1)
-                    
-                    if can_full_toggle:
-                        # 자유롭게 순환: F → N → R → F → ...
-                        if st.gear == "F":
-                            st.gear = "N"
-                        elif st.gear == "N":
-                            st.gear = "R"
-                        elif st.gear == "R":
-                            st.gear = "F"
-                        if DEBUG:
-                            print(f"[GEAR] Changed to {st.gear} (full toggle)")
-                    else:
-                        # 제한된 전환: F ↔ N, R ↔ N
-                        if st.gear == "F":
-                            st.gear = "N"
-                            if DEBUG:
-                                print(f"[GEAR] F → N")
-                        elif st.gear == "R":
-                            st.gear = "N"
-                            if DEBUG:
-                                print(f"[GEAR] R → N")
-                        elif st.gear == "N":
-                            # N에서는 이동 방향에 따라 복귀
-                            if st.move_direction == -1:
-                                st.gear = "R"
-                                if DEBUG:
-                                    print(f"[GEAR] N → R (move_direction=-1)")
-                            else:
-                                st.gear = "F"
-                                if DEBUG:
-                                    print(f"[GEAR] N → F (move_direction=1)")
-
-                elif name == "setTrainLength":
-                    length = int(payload.get("length", 8))
-                    cur_length = length #  상태 저장
-
-                    # 길이 반영
-                    sim.veh.update_mass(cur_length)
-
-                    # 탑승률이 이미 있다면 총중량 덮어쓰기 + 재계산
-                    base_1c_t = sim.veh.mass_t
-                    pax_1c_t = 10.5
-                    total_tons = cur_length * (base_1c_t + pax_1c_t * cur_load_rate)
-                    sim.veh.mass_kg = total_tons * 1000.0
-                    sim.veh.recompute_davis(sim.veh.mass_kg)
-                    sim.veh.calibrate_C2_from_power(300.0, eta=0.85)
-
-                    if DEBUG:
-                        print(f"[Length] {cur_length} cars | load={cur_load_rate*100:.1f}% "
-                            f"-> mass_kg={sim.veh.mass_kg:.0f}, A0={sim.veh.A0:.1f}, B1={sim.veh.B1:.2f}, C2={sim.veh.C2:.2f}")
-                    sim.reset()
-
-                elif name == "setMassTons":
-                    mass_tons = float(payload.get("mass_tons", 200.0))
-                    sim.veh.mass_t = mass_tons / int(payload.get("length", 8))
-                    sim.veh.mass_kg = mass_tons * 1000.0
-                    sim.veh.recompute_davis(sim.veh.mass_kg) #  새 질량으로 재계산
-                    sim.veh.calibrate_C2_from_power(300.0, eta=0.85)
-                    if DEBUG:
-                        print(
-                            f"총중량={mass_tons:.2f} t -> "
-                            f"A0={sim.veh.A0:.1f}, B1={sim.veh.B1:.2f}, C2={sim.veh.C2:.2f}"
-                        )
-                    sim.reset()
-
-                elif name == "setLoadRate":
-                    cur_load_rate = float(payload.get("loadRate", 0.0)) / 100.0 #  상태 저장
-
-                    # 길이/탑승률로 총중량 재산출
-                    base_1c_t = sim.veh.mass_t
-                    pax_1c_t = 10.5
-                    total_tons = cur_length * (base_1c_t + pax_1c_t * cur_load_rate)
-
-                    sim.veh.update_mass(cur_length) # 1차 (길이 반영)
-                    sim.veh.mass_kg = total_tons * 1000.0 # 실제 총중량 덮어쓰기
-                    sim.veh.recompute_davis(sim.veh.mass_kg) # 최종 재계산
-                    sim.veh.calibrate_C2_from_power(300.0, eta=0.85)
-
-                    if DEBUG:
-                        print(f"[LoadRate] length={cur_length}, load={cur_load_rate*100:.1f}% "
-                            f"-> mass_kg={sim.veh.mass_kg:.0f}, A0={sim.veh.A0:.1f}, B1={sim.veh.B1:.2f}, C2={sim.veh.C2:.2f}")
-                    sim.reset()
-
-
-
-                elif name == "setTASC":
-                    enabled = bool(payload.get("enabled", False))
-                    sim.tasc_enabled = enabled
-                    sim.tasc_enabled_initially = enabled  # random mode 복구용 저장
-                    if enabled:
-                        sim.manual_override = False
-                        sim._tasc_last_change_t = sim.state.t
-                        sim._tasc_phase = "build"
-                        sim._tasc_peak_notch = 1
-                        sim.tasc_armed = True
-                        sim.tasc_active = False
-                    if DEBUG:
-                        print(f"TASC set to {enabled}")
-
-                elif name == "obstacleStopSuccess":
-                    sim.eb_used = False
-                    sim.first_brake_done = True
-                elif name == "obstacleStopFail":
-                    sim.run_over = True
-
-
-                elif name == "setMu":
-                    value = float(payload.get("value", 1.0))
-                    sim.scn.mu = value
-                    if DEBUG:
-                        print(f"마찰계수(mu)={value}")
-                    sim.reset()
-
-
-                elif name == "setVehicleFile":
-                    rel = payload.get("file", "")
-                    if rel:
-                        try:
-                            # 경로 정규화
-                            rel_norm = rel.strip()
-                            if rel_norm.startswith("/static/emu_db/"): rel_norm = rel_norm[len("/static/emu_db/"):]
-                            elif rel_norm.startswith("static/emu_db/"): rel_norm = rel_norm[len("static/emu_db/"):]
-                            path = os.path.join(STATIC_DIR + "/emu_db", rel_norm)
-
-                            if not os.path.isfile(path):
-                                raise FileNotFoundError(path)
-
-                            newv = Vehicle.from_json(path)
-                            newv.notch_accels = list(reversed(newv.notch_accels))
-                            newv.notches = len(newv.notch_accels)
-                            newv.recompute_davis(newv.mass_kg)
-
-                            sim.veh = newv
-                            vehicle = newv
-
-                            # 🔒 차량 교체 직후, 현재 길이/탑승률 재적용 (순서 무관 일관성 보장)
-                            sim.veh.update_mass(cur_length)
-                            base_1c_t = sim.veh.mass_t
-                            pax_1c_t = 10.5
-                            total_tons = cur_length * (base_1c_t + pax_1c_t * cur_load_rate)
-                            sim.veh.mass_kg = total_tons * 1000.0
-                            sim.veh.recompute_davis(sim.veh.mass_kg)
-                            sim.veh.calibrate_C2_from_power(300.0, eta=0.85)
-
-                            sim.reset()
-
-                            if DEBUG:
-                                print(f"[Vehicle] switched -> {rel} ({path}) | len={cur_length}, load={cur_load_rate*100:.1f}% "
-                                    f"| mass_kg={sim.veh.mass_kg:.0f} A0={sim.veh.A0:.1f} B1={sim.veh.B1:.2f} C2={sim.veh.C2:.2f}")
-                        except Exception as e:
-                            if DEBUG: print(f"[Vehicle] load failed: {rel} -> {e}")
-
-
-                elif name == "reset":
-                    sim.reset()
-
-                # ---------- 타이머/페널티/보너스/보정 설정 ----------
-                elif name == "setTimerFormula":
-                    # payload: { "enabled": true, "v_target_kmh": 70, "buffer_s": 0 }
-                    sim.timer_use_table = False
-                    sim.state.timer_enabled = bool(payload.get("enabled", True))
-                    sim.timer_v_target_kmh = float(payload.get("v_target_kmh", 70))
-                    sim.timer_buffer_s = float(payload.get("buffer_s", 0.0))
-                    sim.reset()
-
-                elif name == "setTimerTable":
-                    # payload: { "enabled": true, "table": { "60":35, "70":30, "80":26 } }
-                    tbl = payload.get("table", {})
-                    sim.timer_use_table = True
-                    sim.state.timer_enabled = bool(payload.get("enabled", True))
-                    sim.timer_table = {int(k): float(v) for k, v in tbl.items()}
-                    sim.reset()
-
-                elif name == "toggleTimer":
-                    # payload: { "enabled": false }
-                    sim.state.timer_enabled = bool(payload.get("enabled", False))
-                    sim.reset()
-
-                elif name == "setTimerPenalty":
-                    # payload: { "per_s": 20, "cap": 400 }
-                    sim.timer_overtime_penalty_per_s = float(payload.get("per_s", 20.0))
-                    sim.timer_overtime_penalty_cap = float(payload.get("cap", 400.0))
-
-                elif name == "setTimerExactBonus":
-                    # payload: {"bonus": 100}
-                    sim.timer_exact_bonus = float(payload.get("bonus", 100))
-
-                elif name == "setTimerCalib":
-                    # payload 예시:
-                    # {
-                    #   "points":[
-                    #     {"v":60, "L":200, "t":23},
-                    #     {"v":70, "L":200, "t":28},
-                    #     {"v":90, "L":400, "t":30}
-                    #   ],
-                    #   "norm_v": 100, "norm_L": 300,
-                    #   "idw_power": 2.0, "blend_threshold": 1.5
-                    # }
-                    pts = payload.get("points", [])
-                    sim.set_timer_calibration(
-                        points=pts,
-                        norm_v=payload.get("norm_v"),
-                        norm_L=payload.get("norm_L"),
-                        idw_power=payload.get("idw_power"),
-                        blend_threshold=payload.get("blend_threshold"),
-                    )
-                    # 자동 산출이 적용되도록 리셋
-                    sim.state.timer_enabled = True
-                    sim.reset()
-                
-                elif name == "pause":
-                    # 🎮 게임 일시정지
-                    sim.state.paused = True
-                    if DEBUG:
-                        print(f"[PAUSE] Game paused at t={sim.state.t:.2f}s, v={sim.state.v*3.6:.1f}km/h")
-
-                elif name == "resume":
-                    # 🎮 게임 재개
-                    sim.state.paused = False
-                    if DEBUG:
-                        print(f"[RESUME] Game resumed from t={sim.state.t:.2f}s, v={sim.state.v*3.6:.1f}km/h")
-                
-                else:
-                     cmd_val = payload.get("val", payload.get("delta", 0))
-                     sim.queue_command(name, cmd_val)    
-                
-
+                inbox.put_nowait(await ws.receive_text())
         except WebSocketDisconnect:
-            if DEBUG:
-                print("WebSocket disconnected (recv_loop).")
-        except asyncio.CancelledError:
-            pass
+            logger.debug("WebSocket disconnected (recv_loop).")
         except Exception as e:
-            if DEBUG:
-                print(f"Error during receive: {e}")
-
-    async def sim_loop():
-        dt = sim.scn.dt
-        step_count = 0
-        t_start = None  # 시작 시점은 start() 눌렀을 때 설정
-        was_running = False
-        was_finished = False
-        was_paused = False
-        loop_iterations = 0
-
-        while True:
-            loop_iterations += 1
-            
-            # Detect if finished state just changed (soft-reset/advanceStation happened)
-            is_finished_now = getattr(sim.state, 'finished', False)
-            if is_finished_now != was_finished:
-                if DEBUG:
-                    print(f"[SIM_LOOP] Finished state changed: {was_finished} → {is_finished_now}")
-                if not is_finished_now and was_finished and sim.running:
-                    # Just transitioned from finished→not-finished while running
-                    # This means advanceStation reset the state, so reset timing!
-                    if DEBUG:
-                        print(f"[SIM_LOOP] *** DETECTED SOFT-RESET: Resetting timing (iteration {loop_iterations})")
-                    t_start = time.time()
-                    step_count = 0
-                was_finished = is_finished_now
-            
-            # 🎮 게임 일시정지 상태 확인
-            is_paused_now = getattr(sim.state, 'paused', False)
-            if is_paused_now and not was_paused:
-                if DEBUG:
-                    print(f"[SIM_LOOP] Game paused (iteration {loop_iterations})")
-            elif not is_paused_now and was_paused:
-                if DEBUG:
-                    print(f"[SIM_LOOP] Game resumed (iteration {loop_iterations})")
-                # 일시정지에서 복귀하면 시간 기준점을 갱신
-                t_start = time.time()
-                step_count = 0
-            was_paused = is_paused_now
-            
-            if sim.running and not is_paused_now:  # 게임 실행 중이고 일시정지 아님
-                if not was_running:
-                    if DEBUG:
-                        print(f"[SIM_LOOP] Transitioned to running state (iteration {loop_iterations})")
-                    t_start = time.time()
-                    step_count = 0
-
-                t_now = time.time()
-                expected_steps = int((t_now - t_start) / dt)
-
-            # 누적된 스텝만큼만 진행
-                for _ in range(step_count, expected_steps):
-                    if DEBUG and loop_iterations % 100 == 0:
-                        print(f"[SIM_LOOP] Executing step (iteration {loop_iterations}, step {step_count})")
-                    sim.step()
-
-                step_count = expected_steps
-                was_running = True
-
-            else:
-            # ★ 정지 상태에서는 기준값들을 항상 초기화
-                if was_running and DEBUG:
-                    print(f"[SIM_LOOP] Transitioned to stopped state (iteration {loop_iterations})")
-                was_running = False
-                t_start = None
-                step_count = 0
+            logger.debug("Error during receive: %s", e)
 
-            await asyncio.sleep(dt)  # dt 기반 sleep (CPU 효율성)
-
-
-    async def send_loop():
+    async def recv_loop():
         try:
             while True:
-                await ws.send_text(json.dumps({"type": "state", "payload": sim.snapshot()}))
-                await asyncio.sleep(send_interval)
-        except WebSocketDisconnect:
-            if DEBUG:
-                print("WebSocket disconnected (send_loop).")
+                # 하나를 기다린 뒤, 그 사이 쌓인 메시지를 이벤트 루프 양보 없이 모두 꺼낸다
+                batch = [await inbox.get()]
+                while not inbox.empty():
+                    batch.append(inbox.get_nowait())
+                _dispatch_commands(conn, [p for p in map(_parse_cmd, batch) if p is not None])
+
         except asyncio.CancelledError:
             pass
         except Exception as e:
-            if DEBUG:
-                print(f"Error during send: {e}")
+            logger.debug("Error during receive: %s", e)
+
+    # 상태 전송은 _broadcast_loop가 담당; 전송 실패 시 closed가 set됨
+    closed = _register_client(ws, sim)
 
     tasks = [
+        asyncio.create_task(reader()),
         asyncio.create_task(recv_loop()),
-        asyncio.create_task(sim_loop()),
-        asyncio.create_task(send_loop()),
+        asyncio.create_task(closed.wait()),
     ]
 
     try:
-        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        # sim_loop는 세션 공유 태스크: 함께 기다리되(비정상 종료 시 접속 정리) 취소는 _release_session에서
+        await asyncio.wait([*tasks, conn.sim_task], return_when=asyncio.FIRST_COMPLETED)
     finally:
+        _unregister_client(ws)
         for t in tasks:
             t.cancel()
+        _release_session(session_id, conn)
         try:
             await ws.close()
-        except RuntimeError:
-            pass
\ No newline at end of file
+        except (RuntimeError, WebSocketDisconnect):
+            pass
+
+
+if __name__ == "__main__":
+    # 직접 실행 시: uvloop가 있으면 libuv 기반 루프로 (uvicorn CLI는 --loop uvloop 또는 기본 auto로 동일)
+    import uvicorn
+
+    if uvloop is not None:
+        uvloop.install()
+    uvicorn.run(
+        app,
+        host=os.environ.get("HOST", "0.0.0.0"),
+        port=int(os.environ.get("PORT", "8000")),
+        loop="uvloop" if uvloop is not None else "asyncio",
+    )
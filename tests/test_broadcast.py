@@ -0,0 +1,54 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tasc"))
+
+import server  # noqa: E402
+
+
+def _snap(sim):
+    return (sim._snap_static, sim.snapshot_dynamic())
+
+
+def test_idle_sim_produces_no_frame():
+    sim = server._new_session().sim
+    prev = _snap(sim)
+    assert server._encode_frame(_snap(sim), prev, ts_ns=1) is None
+
+
+def test_delta_carries_changed_fields_and_timestamp():
+    sim = server._new_session().sim
+    prev = _snap(sim)
+    sim.running = True
+    sim.step()
+    frame = json.loads(server._encode_frame(_snap(sim), prev, ts_ns=42))
+    assert frame["type"] == "delta"
+    assert frame["payload"]["server_ts_ns"] == 42
+    assert "t" in frame["payload"]
+    assert "L" not in frame["payload"]
+
+
+def test_full_frame_includes_static_fields():
+    sim = server._new_session().sim
+    frame = json.loads(server._encode_frame(_snap(sim), None, ts_ns=7))
+    assert frame["type"] == "state"
+    assert frame["payload"]["L"] == sim.scn.L
+    assert frame["payload"]["server_ts_ns"] == 7
+
+
+def test_paused_moving_sim_announces_pause_before_going_quiet():
+    conn = server._new_session()
+    sim = conn.sim
+    server._cmd_start(conn, {})
+    for _ in range(10):
+        sim.step()
+    assert sim.state.v > 10.0
+    prev = _snap(sim)
+
+    server._cmd_pause(conn, {})
+    paused = _snap(sim)
+    frame = json.loads(server._encode_frame(paused, prev, ts_ns=1))
+    # 마지막 프레임이 paused를 실어야 클라이언트가 v/a로 외삽을 멈춘다
+    assert frame["payload"]["paused"] is True
+    assert server._encode_frame(_snap(sim), paused, ts_ns=2) is None
@@ -0,0 +1,132 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tasc"))
+
+import server  # noqa: E402
+
+
+def _started():
+    conn = server._new_session()
+    server._cmd_start(conn, {})
+    return conn
+
+
+def _run(sim, seconds):
+    for _ in range(int(seconds / sim.scn.dt)):
+        sim.step()
+
+
+def test_float_notch_values_do_not_break_step():
+    conn = _started()
+    sim = conn.sim
+    server._cmd_set_notch(conn, {"name": "setNotch", "val": 2.0})
+    _run(sim, 1.0)
+    assert sim.state.lever_notch == 2
+    server._cmd_step_notch(conn, {"name": "stepNotch", "delta": 1.0})
+    _run(sim, 1.0)
+    assert sim.state.lever_notch == 3
+    assert sim.notch_history[-1] == 3
+    assert list(sim._notch_runs)[-2:] == [2, 3]
+
+
+def test_non_numeric_notch_values_are_ignored():
+    conn = _started()
+    sim = conn.sim
+    server._cmd_set_notch(conn, {"name": "setNotch", "val": 2})
+    for bad in ("abc", None, float("nan"), [1]):
+        server._cmd_set_notch(conn, {"name": "setNotch", "val": bad})
+        server._cmd_step_notch(conn, {"name": "stepNotch", "delta": bad})
+    _run(sim, 1.0)
+    assert sim.state.lever_notch == 2
+
+
+def _state_after(conn, seconds=2.0):
+    sim = conn.sim
+    _run(sim, seconds)
+    snap = sim.snapshot()
+    snap.pop("server_ts_ns")
+    return snap, (sim.veh.mass_kg, sim.veh.A0, sim.veh.B1, sim.veh.C2, sim.scn.mu)
+
+
+def _dispatch_one_by_one(payloads):
+    # 합치기 이전의 처리: 명령마다 바로 핸들러 + 리셋
+    conn = _started()
+    for p in payloads:
+        server.COMMAND_HANDLERS.get(p["name"], server._cmd_default)(conn, p)
+        conn.sim.flush_pending_reset()
+    return conn
+
+
+def _dispatch_batched(payloads):
+    conn = _started()
+    server._dispatch_commands(conn, payloads)
+    return conn
+
+
+def _count_resets(sim):
+    calls = []
+    reset = sim.reset
+
+    def counting_reset():
+        calls.append(sim.state.t)
+        reset()
+    sim.reset = counting_reset
+    return calls
+
+
+CONFIG_BURST = [
+    {"name": "setTrainLength", "length": 8},
+    {"name": "setLoadRate", "loadRate": 50},
+    {"name": "setMu", "value": 0.8},
+    {"name": "setMassTons", "mass_tons": 330.0, "length": 8},
+    {"name": "toggleTimer", "enabled": True},
+]
+
+
+def test_config_burst_resets_once_with_same_result():
+    conn = _started()
+    resets = _count_resets(conn.sim)
+    server._dispatch_commands(conn, CONFIG_BURST)
+    assert len(resets) == 1
+    assert _state_after(conn) == _state_after(_dispatch_one_by_one(CONFIG_BURST))
+
+
+def test_pending_reset_lands_before_later_commands():
+    # 설정 → 노치 → 설정 순서: 노치 명령 앞에서 리셋이 먼저 반영되고, 뒤쪽 설정의 리셋은 묶음 끝에서 한 번
+    payloads = [
+        {"name": "setMu", "value": 0.9},
+        {"name": "setLoadRate", "loadRate": 30},
+        {"name": "setNotch", "val": 3},
+        {"name": "setTrainLength", "length": 6},
+        {"name": "stepNotch", "delta": 1},
+    ]
+    conn = _started()
+    resets = _count_resets(conn.sim)
+    server._dispatch_commands(conn, payloads)
+    assert len(resets) == 2
+    batched = _state_after(conn)
+    assert batched == _state_after(_dispatch_one_by_one(payloads))
+
+
+def test_set_notch_burst_keeps_last_value():
+    payloads = [{"name": "setNotch", "val": v} for v in (1, 2, 5, 3)]
+    assert server._coalesce_commands(payloads) == [payloads[-1]]
+    conn = _dispatch_batched(payloads)
+    assert [c[1:] for c in conn.sim._cmd_queue] == [("setNotch", 3)]
+    assert _state_after(conn) == _state_after(_dispatch_one_by_one(payloads))
+
+
+def test_set_notch_coalescing_keeps_relative_commands_in_order():
+    payloads = [
+        {"name": "setNotch", "val": 2},
+        {"name": "setNotch", "val": 4},
+        {"name": "stepNotch", "delta": -1},
+        {"name": "setNotch", "val": 1},
+        {"name": "setNotch", "val": 5},
+        {"name": "stepNotch", "delta": 1},
+    ]
+    assert [p.get("val", p.get("delta")) for p in server._coalesce_commands(payloads)] == [4, -1, 5, 1]
+    batched = _state_after(_dispatch_batched(payloads))
+    assert batched == _state_after(_dispatch_one_by_one(payloads))
+    assert batched[0]["lever_notch"] == 6
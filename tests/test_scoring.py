@@ -0,0 +1,64 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tasc"))
+
+import server  # noqa: E402
+
+
+def _shift(t0, script):
+    return [(0.0, 0)] + [(t + t0, v) for t, v in script]
+
+
+# (시각 s, setNotch 값 / None=EB) 스크립트. 기본 시나리오(80 km/h, 400 m)에서 정지 위치 ±1 m 안에 서도록
+# 제동 시작 시각을 맞춰 두었다 → 종료 채점(step_brake_incomplete)까지 지난다.
+SCRIPTS = {
+    "stair": _shift(1.406, [(0, 2), (2, 4), (4, 6), (9, 5), (13, 4), (17, 3), (21, 2), (25, 1)]),
+    "not_stair": _shift(3.375, [(0, 3), (3, 6), (6, 4), (9, 7), (14, 2)]),
+    "eb": _shift(8.906, [(0, 4), (3, None)]),
+}
+
+
+def _record(script=(), tasc=False, tmax=120.0):
+    conn = server._new_session()
+    sim = conn.sim
+    if tasc:
+        server._cmd_set_tasc(conn, {"enabled": True})
+    server._cmd_start(conn, {})
+    todo = list(script)
+    while not sim.state.finished and sim.state.t < tmax:
+        while todo and sim.state.t >= todo[0][0]:
+            _, val = todo.pop(0)
+            if val is None:
+                server._cmd_emergency_brake(conn, {})
+            else:
+                server._cmd_set_notch(conn, {"val": val})
+        sim.step()
+    return sim
+
+
+@pytest.mark.parametrize("case", [*SCRIPTS, "tasc"])
+def test_incremental_runs_match_full_history_scoring(case):
+    sim = _record(tasc=True) if case == "tasc" else _record(SCRIPTS[case])
+    assert sim.state.finished
+    history = list(sim.notch_history)
+    assert len(history) > 100
+
+    # 증분 변화열 == 전체 이력의 연속 중복 제거 (기존 채점 입력)
+    assert list(sim._notch_runs) == sim.remove_adjacent_duplicates(history)
+    assert sim.is_stair_pattern(sim._notch_runs) == sim.is_stair_pattern(history)
+    assert sim.eb_used_from_history() == any(n == sim.veh.notches - 1 for n in history)
+    assert sim.state.issues["step_brake_incomplete"] == (not sim.is_stair_pattern(history))
+
+
+def test_recorded_histories_cover_both_stair_outcomes():
+    assert sim_is_stair(SCRIPTS["stair"]) is True
+    assert sim_is_stair(SCRIPTS["not_stair"]) is False
+    assert _record(SCRIPTS["eb"]).eb_used_from_history() is True
+
+
+def sim_is_stair(script):
+    sim = _record(script)
+    return sim.is_stair_pattern(list(sim.notch_history))